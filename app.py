@@ -1,28 +1,252 @@
 import os
-from flask import Flask, request, jsonify,render_template
+import atexit
+import base64
+import functools
+import hashlib
+import importlib.util
+import io
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import islice
+from flask import Flask, Response, request, jsonify,render_template, send_file, send_from_directory, g
 from http import HTTPStatus
+from datetime import datetime
 import csv
+import json
 import time
 from models.electricity_account import ElectricityAccount
 from models.meter_reading import MeterReading
-from utils import is_valid_meter_id, load_electricity_accounts_from_file, save_electricity_accounts_to_file, save_to_half_hourly_csv, calculate_daily_usage, calculate_monthly_usage
-from flasgger import Swagger
+from models.meter_reading_buffer import MeterReadingBuffer
+from models.meter_registry import MeterRegistry
+from columnar_store import ColumnarReadingStore
+from validation import validate_reading, validate_readings, error_messages
+from utils import (is_valid_meter_id, load_electricity_accounts_from_file, save_electricity_accounts_to_file,
+                   save_electricity_accounts_batch_to_file, compact_electricity_accounts, HalfHourlyWriter,
+                   calculate_daily_usage, calculate_monthly_usage, compact_monthly_usage_if_due, usage_file_state,
+                   rollback_usage_files, load_usage_files, is_row_start,
+                   daily_row_to_reading, monthly_row_to_reading, rendered_usage_path, is_rendered_usage_stale,
+                   render_usage_snapshots, shared_storage, sqlite_storage, load_registered_account, configure_logging,
+                   logger, half_hourly_readings_csv_filepath, daily_file, monthly_file)
+from rollup_cube import rollup_dimensions
+from readings_snapshot import recover_meter_readings, save_readings_snapshot, readings_snapshot_interval_s
+import metrics
+import profiler
+import backfill
+from dedup import ReadingDedupIndex
+from process_lock import ProcessLock
 from flask_cors import CORS
 
 app = Flask(__name__)
 app.config['SWAGGER'] = {
     'title': 'AN6007 ADVANCED PROGRAMMING - Electricity Meter Service API'
 }
-swagger = Swagger(app)
 CORS(app)
 
+# The Swagger spec is prebuilt from the route docstrings by build_openapi.py and served as a static
+# file, so workers neither import flasgger nor parse every docstring's YAML. METER_LIVE_OPENAPI=1
+# (or a missing static/openapi.json) builds it at runtime with flasgger instead.
+openapi_spec_file = os.path.join(app.static_folder, 'openapi.json')
+if os.environ.get("METER_LIVE_OPENAPI") or not os.path.exists(openapi_spec_file):
+    from flasgger import Swagger
+    swagger = Swagger(app)
+else:
+    swagger_ui_static = os.path.join(importlib.util.find_spec("flasgger").submodule_search_locations[0], 'ui3', 'static')
+
+    @app.route("/apispec_1.json", methods=["GET"])
+    def apispec():
+        return send_file(openapi_spec_file, mimetype="application/json")
+
+    @app.route("/apidocs/", methods=["GET"])
+    def apidocs():
+        return render_template("apidocs.html", title=app.config['SWAGGER']['title'])
+
+    @app.route("/flasgger_static/<path:filename>", methods=["GET"])
+    def swagger_ui_asset(filename):
+        return send_from_directory(swagger_ui_static, filename)
+
+# Buffered, leveled logging for the whole service
+log_listener = configure_logging()
+atexit.register(log_listener.stop)
+
 # Globals for in-memory storage
-meter_accounts = load_electricity_accounts_from_file()
-meter_list = [i.meter_id for i in meter_accounts] # known meter Ids
-meter_readings = {}
+meter_registry = MeterRegistry(load_electricity_accounts_from_file(), fallback=load_registered_account if shared_storage() else None) # known meters, indexed by meter Id
+meter_readings, _ = recover_meter_readings() # meter Id -> today's readings, rebuilt after a crash
+reading_dedup = ReadingDedupIndex() # (meter Id, timestamp, value) of readings stored, to drop retries
+reading_dedup.seed(meter_readings)
+usage_state_loaded = sqlite_storage().usage_state() if shared_storage() else None # committed usage files the state below reflects
+# One pass over each usage file builds:
+#   daily_usage_index: meter Id -> daily usage row offsets, sorted by date
+#   monthly_usage_index: meter Id -> offsets of each month's latest row
+#   latest_daily_usage, latest_monthly_usage: meter Id -> latest daily / monthly usage row
+#   monthly_usage: (meter Id, month) -> month-to-date usage row
+#   usage_cube: usage totals per day/month and region/area/dwelling type
+daily_usage_index, monthly_usage_index, latest_daily_usage, latest_monthly_usage, monthly_usage, usage_cube = load_usage_files()
+
+# Pre-rendered bodies for /meters/daily and /meters/monthly, refreshed by every batch
+for usage_index, name, to_reading in ((daily_usage_index, "daily", daily_row_to_reading), (monthly_usage_index, "monthly", monthly_row_to_reading)):
+    if is_rendered_usage_stale(usage_index.usage_file, name):
+        render_usage_snapshots(usage_index.usage_file, name, to_reading, usage_index)
+
+# Columnar day partitions of the half-hourly readings, written by the batch job
+reading_store = ColumnarReadingStore()
+
+# Background writer for the half-hourly CSV
+half_hourly_writer = HalfHourlyWriter()
+atexit.register(half_hourly_writer.close)
+
+# Guards swapping meter_readings for a fresh buffer against concurrent appends
+readings_lock = threading.Lock()
+
+# Progress of the nightly batch job or a backfill, reported by /stop_server/status
+batch_status = {"state": "idle", "job": None, "phase": None, "meters": 0, "started_at": None, "finished_at": None, "error": None}
+
+# Held by whichever worker runs the nightly batch or a backfill, so only one runs at a time across workers
+batch_lock = ProcessLock(os.path.join('archived_data', 'batch.lock'))
+
+# Shared mode: how often to check whether another worker's batch or backfill committed new usage
+usage_refresh_interval_s = 5
+
+# Set from the nightly swap until the batch's checkpoint: its snapshot is in neither meter_readings nor the CSV past the last offset
+batch_in_flight = False
+
+# Serializes readings snapshots, which share one temporary file
+checkpoint_lock = threading.Lock()
+
+
+def checkpoint_readings(commit=False):
+    """Snapshot today's readings together with the half-hourly CSV offset and the usage files they cover.
+
+    While a batch is in flight only its own commit checkpoint is taken, so the last snapshot
+    still holds the readings swapped out and the usage files from before the batch.
+    """
+    if shared_storage():
+        return # the database is the recovery point
+    with checkpoint_lock:
+        with readings_lock:
+            if batch_in_flight and not commit:
+                return
+            half_hourly_writer.flush()
+            csv_offset = os.path.getsize(half_hourly_readings_csv_filepath) if os.path.exists(half_hourly_readings_csv_filepath) else 0
+            buffers = {meter_id: buffer.copy() for meter_id, buffer in meter_readings.items()}
+            usage_state = usage_file_state()
+        save_readings_snapshot(buffers, csv_offset, usage_state)
+
+
+def checkpoint_loop():
+    while True:
+        time.sleep(readings_snapshot_interval_s)
+        try:
+            checkpoint_readings()
+        except Exception as e:
+            logger.error("Error writing readings snapshot: %s", e)
+
+
+if not shared_storage():
+    checkpoint_readings()
+    threading.Thread(target=checkpoint_loop, name="readings-checkpoint", daemon=True).start()
+    atexit.register(checkpoint_readings)
+
+
+def today_readings(meter_id):
+    """A meter's readings since the last batch job: this process's buffer, or the shared database's"""
+    if shared_storage():
+        # Write this worker's queued readings first, so a reading is readable once acknowledged here
+        half_hourly_writer.flush()
+        return sqlite_storage().pending_readings(meter_id)
+    return meter_readings.get(meter_id)
+
+# Largest page the bulk usage endpoints will return at once
+max_page_size = 10000
+
+# Responses of endpoints whose data only changes when the batch job runs:
+# (path, query) -> (body, mimetype, ETag), cleared when the batch completes
+response_cache = {}
+response_cache_max_entries = 10000
+response_cache_lock = threading.Lock()
+response_cache_generation = 0 # bumped on every invalidation
+usage_cache_max_age_s = 60
+usage_last_modified = max([os.path.getmtime(path) for path in (daily_file, monthly_file) if os.path.exists(path)], default=time.time())
+
+
+def cached_response(view):
+    """Cache a view's response until the next batch, with a strong ETag, Last-Modified and 304 support"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        entry = response_cache.get(key)
+        if entry is None:
+            generation = response_cache_generation
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                # Errors are not cached; streams and files are too big to, but still get validators
+                if response.status_code == 200:
+                    if response.last_modified is None:
+                        response.last_modified = usage_last_modified
+                    response.headers["Cache-Control"] = f"public, max-age={usage_cache_max_age_s}"
+                    return response.make_conditional(request)
+                return response
+
+            body = response.get_data()
+            entry = (body, response.mimetype, hashlib.sha1(body).hexdigest())
+            # Don't keep what was built from half-updated data while, or just before, a batch finished
+            with response_cache_lock:
+                if batch_status["state"] != "running" and generation == response_cache_generation:
+                    if len(response_cache) >= response_cache_max_entries:
+                        response_cache.pop(next(iter(response_cache)))
+                    response_cache[key] = entry
+
+        body, mimetype, etag = entry
+        response = Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+        response.last_modified = usage_last_modified
+        response.headers["Cache-Control"] = f"public, max-age={usage_cache_max_age_s}"
+        return response.make_conditional(request)
+    return wrapper
 
-# Global for server online status
-acceptAPI = True
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Count every request and its latency per route template, so /meters/<meter_id>/... stays one series"""
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        metrics.http_request_duration_seconds.observe(time.perf_counter() - started, route=route, method=request.method)
+        metrics.http_requests_total.inc(route=route, method=request.method, status=response.status_code)
+    return response
+
+
+@app.before_request
+def start_request_profile():
+    """Profile this request if it asks to with an X-Profile header, or its route has been armed via /profiler"""
+    route = request.url_rule.rule if request.url_rule else None
+    mode = request.headers.get("X-Profile")
+    if mode not in profiler.modes:
+        mode = profiler.claim(route, profiler.any_route) if route else None
+    if mode:
+        g.profile_session = profiler.ProfileSession(f"{request.method} {route}", mode)
+
+
+@app.after_request
+def stop_request_profile(response):
+    session = g.pop("profile_session", None)
+    if session is not None:
+        response.headers["X-Profile-Id"] = str(session.stop()["id"])
+    return response
+
+
+def invalidate_response_cache():
+    global usage_last_modified, response_cache_generation
+
+    with response_cache_lock:
+        response_cache.clear()
+        response_cache_generation += 1
+        usage_last_modified = time.time()
 
 
 #####################
@@ -79,9 +303,6 @@ def register():
       409:
         description: Conflict. This meter is already registered.
     """
-    if not acceptAPI:
-        return jsonify({"message": f"The server is temporarily offline for maintenance."}), HTTPStatus.SERVICE_UNAVAILABLE
-    
     data = request.get_json()
     meter_id = data.get("meter_id")
 
@@ -92,7 +313,7 @@ def register():
         return jsonify({"message": "Invalid format. Use format XXX-XXX-XXX (digits only)."}), HTTPStatus.BAD_REQUEST
 
     # Check if meter already exists
-    if meter_id in meter_list:
+    if meter_id in meter_registry:
         return jsonify({
             "meter_id": meter_id,
             "message": "This meter is already registered."
@@ -114,11 +335,9 @@ def register():
         dwelling_type=dwelling_type
     )
 
-    success, message = save_electricity_accounts_to_file(new_account, meter_list=meter_list, meter_accounts=meter_accounts)
+    success, message = save_electricity_accounts_to_file(new_account, meter_registry=meter_registry)
     if not success:
         return jsonify({"message": message}), HTTPStatus.BAD_REQUEST
-    
-    meter_list.append(meter_id)
 
     # # Ensure the daily_usage.csv file exists with the appropriate header.
     # daily_usage_path = os.path.join(os.getcwd(), 'archived_data', 'daily_usage.csv')
@@ -136,7 +355,7 @@ def register():
 
 # API 2: Get meter reading data from IoT meters
 @app.route('/meter-readings', methods=['POST'])
-async def meter_reading():
+def meter_reading():
     """
     Post electricity reading of a single meter to the server.
     ---
@@ -179,6 +398,19 @@ async def meter_reading():
                 data:
                   type: object
                   description: Contains the meter reading details.
+      200:
+        description: The same reading was already received for this meter, date and time, e.g. a retry. It is not stored again. A different value is stored as a correction.
+        content:
+          application/json:
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "Reading already received"
+                data:
+                  type: object
+                  description: Contains the meter reading details.
       400:
         description: Bad Request due to invalid input values.
         content:
@@ -199,16 +431,6 @@ async def meter_reading():
                 error:
                   type: string
                   example: "Meter does not exist! Please register first."
-      503:
-        description: Service Unavailable. The server is temporarily offline for maintenance.
-        content:
-          application/json:
-            schema:
-              type: object
-              properties:
-                message:
-                  type: string
-                  example: "The server is temporarily offline for maintenance."
       500:
         description: Internal Server Error.
         content:
@@ -220,9 +442,6 @@ async def meter_reading():
                   type: string
                   example: "Unexpected error occurred."
     """
-    if not acceptAPI:
-        return jsonify({"message": f"The server is temporarily offline for maintenance."}), HTTPStatus.SERVICE_UNAVAILABLE
-
     try:
         # Get form data
         meter_id = request.form.get('meter_id')
@@ -231,27 +450,28 @@ async def meter_reading():
         electricity_reading = request.form.get('electricity_reading')
 
         # Check if meter exists
-        if meter_id not in meter_list:
+        if meter_id not in meter_registry:
             return {"error": "Meter does not exist! Please register first."}, HTTPStatus.FORBIDDEN
 
-        try:
-            reading = MeterReading.validate_and_create(
-                meter_id=meter_id,
-                date=date,
-                time=time,
-                electricity_reading=electricity_reading
-            )
-        except ValueError as e:
-            return {"error": str(e)}, HTTPStatus.BAD_REQUEST
-
-        # Save to CSV if all validations pass
-        await save_to_half_hourly_csv([reading.meter_id, reading.date, reading.time, reading.electricity_reading])
-
-        # in-memory dict of MeterReading objects
-        if reading.meter_id in meter_readings:
-            meter_readings[reading.meter_id].append(reading)
-        else:
-            meter_readings[reading.meter_id] = [reading]
+        error, timestamp, electricity_reading = validate_reading(meter_id, date, time, electricity_reading)
+        if error:
+            return {"error": f"Validation failed: {error_messages[error]}"}, HTTPStatus.BAD_REQUEST
+        reading = MeterReading(meter_id, date, time, electricity_reading)
+
+        # Queue for the CSV and add to the in-memory buffer of today's readings together,
+        # so a snapshot taken under readings_lock lines up exactly with the CSV
+        with readings_lock:
+            if reading_dedup.check(meter_id, timestamp, electricity_reading):
+                # A retry of a reading already stored: acknowledge it again, store nothing
+                return {
+                    "message": "Reading already received",
+                    "data": reading.to_dict()
+                }, HTTPStatus.OK
+            seq = half_hourly_writer.enqueue([[reading.meter_id, reading.date, reading.time, reading.electricity_reading]])
+            if not shared_storage():
+                meter_readings[reading.meter_id].append(timestamp, reading.electricity_reading)
+            reading_dedup.record(meter_id, timestamp, electricity_reading)
+        half_hourly_writer.acknowledge(seq)
 
         # Return success response with the reading data
         return {
@@ -265,6 +485,7 @@ async def meter_reading():
       
 # API 3: Get last daily reading for a specific meter Id
 @app.route('/meters/<meter_id>/daily/latest', methods=['GET'])
+@cached_response
 def get_latest_daily_meter_usage(meter_id):
     """
     Get the latest daily meter usage reading.
@@ -306,14 +527,6 @@ def get_latest_daily_meter_usage(meter_id):
             message:
               type: string
               example: "No readings found for meter 123-456-789"
-      503:
-        description: Service Unavailable. The server is temporarily offline for maintenance.
-        schema:
-          type: object
-          properties:
-            message:
-              type: string
-              example: "The server is temporarily offline for maintenance."
       500:
         description: Internal Server Error.
         schema:
@@ -323,41 +536,22 @@ def get_latest_daily_meter_usage(meter_id):
               type: string
               example: "Error reading file: [error details]"
     """
-    if not acceptAPI:
-        return jsonify({"message": f"The server is temporarily offline for maintenance."}), HTTPStatus.SERVICE_UNAVAILABLE
-
-    try:
-        with open('archived_data/daily_usage.csv', 'r', newline='') as file:
-            reader = csv.reader(file)
-            # Read header row
-            header = next(reader)
-            last_reading = None
-            for row in reader:
-                # Skip any empty rows
-                if not row:
-                    continue
-                if row[0] == meter_id:
-                    last_reading = row
-
-            if last_reading:
-                return jsonify({
-                    "meter_id": last_reading[0],
-                    "region": last_reading[1],
-                    "area": last_reading[2],
-                    "dwelling_type": last_reading[3],
-                    "date": last_reading[4],
-                    "usage": last_reading[5]
-                }), 200
-            return jsonify({"message": f"No readings found for meter {meter_id}"}), 404
-
-    except FileNotFoundError:
-        return jsonify({"message": "Daily usage file not found"}), 404
-    except Exception as e:
-        return jsonify({"message": f"Error reading file: {str(e)}"}), HTTPStatus.INTERNAL_SERVER_ERROR
+    last_reading = latest_daily_usage.get(meter_id)
+    if last_reading:
+        return jsonify({
+            "meter_id": last_reading[0],
+            "region": last_reading[1],
+            "area": last_reading[2],
+            "dwelling_type": last_reading[3],
+            "date": last_reading[4],
+            "usage": last_reading[5]
+        }), 200
+    return jsonify({"message": f"No readings found for meter {meter_id}"}), 404
   
       
 # API 4: Get last monthly reading for a specific meter Id  
 @app.route('/meters/<meter_id>/monthly/latest', methods=['GET'])
+@cached_response
 def get_latest_monthly_meter_usage(meter_id):
     """
     Get the latest monthly meter usage reading.
@@ -399,14 +593,6 @@ def get_latest_monthly_meter_usage(meter_id):
             message:
               type: string
               example: "No readings found for meter 123-456-789"
-      503:
-        description: Service Unavailable. The server is temporarily offline for maintenance.
-        schema:
-          type: object
-          properties:
-            message:
-              type: string
-              example: "The server is temporarily offline for maintenance."
       500:
         description: Internal Server Error.
         schema:
@@ -416,83 +602,1116 @@ def get_latest_monthly_meter_usage(meter_id):
               type: string
               example: "Error reading file: [error details]"
     """
-    if not acceptAPI:
-        return jsonify({"message": f"The server is temporarily offline for maintenance."}), HTTPStatus.SERVICE_UNAVAILABLE
+    last_reading = latest_monthly_usage.get(meter_id)
+    if last_reading:
+        return jsonify({
+            "meter_id": last_reading[0],
+            "region": last_reading[1],
+            "area": last_reading[2],
+            "dwelling_type": last_reading[3],
+            "date": last_reading[4],
+            "usage": last_reading[5]
+        }), 200
+    return jsonify({"message": f"No readings found for meter {meter_id}"}), 404
+
 
+# API 5: Stop the server and perform batch jobs for maintenance
+@contextmanager
+def batch_phase(phase):
+    """Report a batch phase in /stop_server/status and time it for /metrics"""
+    batch_status["phase"] = phase
+    started = time.perf_counter()
     try:
-        with open('archived_data/monthly_usage.csv', 'r', newline='') as file:
-            reader = csv.reader(file)
-            header = next(reader)  
-            last_reading = None
-
-            for row in reader:
-                if row[0] == meter_id:
-                    last_reading = row
-
-            if last_reading:
-                return jsonify({
-                    "meter_id": last_reading[0],
-                    "region":last_reading[1],
-                    "area": last_reading[2],
-                    "dwelling_type": last_reading[3],
-                    "date": last_reading[4],
-                    "usage": last_reading[5]
-                }), 200
-            return jsonify({"message": f"No readings found for meter {meter_id}"}), 404
-
-    except FileNotFoundError:
-        return jsonify({"message": "Monthly usage file not found"}), 404
+        yield
+    finally:
+        metrics.batch_phase_duration_seconds.set(time.perf_counter() - started, phase=phase)
+
+
+def reload_usage_state():
+    """Reload what the API serves from the usage files, after they were rewritten, rolled back or, in shared mode, committed by another worker"""
+    global daily_usage_index, monthly_usage_index, latest_daily_usage, latest_monthly_usage, monthly_usage, usage_cube, usage_state_loaded
+
+    if shared_storage():
+        usage_state_loaded = sqlite_storage().usage_state()
+    daily_usage_index, monthly_usage_index, latest_daily_usage, latest_monthly_usage, monthly_usage, usage_cube = load_usage_files()
+
+
+def record_usage_state():
+    """Make the usage files as they are the rollback point, and in shared mode what the other workers reload"""
+    global usage_state_loaded
+
+    if shared_storage():
+        usage_state_loaded = usage_file_state()
+        sqlite_storage().save_usage_state(usage_state_loaded)
+    else:
+        checkpoint_readings()
+
+
+def load_committed_usage_state():
+    """Shared mode, with the batch lock held: start from the usage files the last batch or backfill of any worker committed"""
+    # Drop the rows of a batch that died before its commit, its readings are claimed again
+    committed_state = sqlite_storage().usage_state()
+    rolled_back = committed_state is not None and rollback_usage_files(committed_state)
+    # Fold onto what other workers' batches and backfills committed, not this worker's copy
+    if rolled_back or committed_state != usage_state_loaded:
+        reload_usage_state()
+    record_usage_state()
+
+
+def refresh_usage_loop():
+    """Shared mode: reload the usage state, and drop cached responses, once another worker commits new usage"""
+    while True:
+        time.sleep(usage_refresh_interval_s)
+        try:
+            # Not while a batch or backfill is writing the files
+            if sqlite_storage().usage_state() == usage_state_loaded or not batch_lock.acquire():
+                continue
+            try:
+                reload_usage_state()
+            finally:
+                batch_lock.release()
+            invalidate_response_cache()
+            logger.info("Reloaded the usage files committed by another worker.")
+        except Exception as e:
+            logger.error("Error reloading usage files: %s", e)
+
+
+if shared_storage():
+    threading.Thread(target=refresh_usage_loop, name="usage-refresh", daemon=True).start()
+
+
+def abort_batch(snapshot, usage_state):
+    """Undo a batch that failed before its checkpoint, so the next one starts over with its readings"""
+    global batch_in_flight
+
+    try:
+        if usage_state is not None:
+            rollback_usage_files(usage_state)
+        reload_usage_state()
     except Exception as e:
-        return jsonify({"message": f"Error reading file: {str(e)}"}), 500
+        logger.exception("Could not roll back the usage files: %s", e)
+
+    if shared_storage():
+        return # the claim was never committed, so the next batch reads the same readings again
+    # Put the snapshot back in front of what arrived since the swap
+    with readings_lock:
+        for meter_id, buffer in snapshot.items():
+            newer = meter_readings.get(meter_id)
+            if newer:
+                buffer.extend(newer)
+            meter_readings[meter_id] = buffer
+        batch_in_flight = False
+    logger.warning("Returned %d meter(s) of readings to the next batch.", len(snapshot))
+
+
+def run_batch_jobs(snapshot):
+    """Archive a frozen snapshot of the day's readings into the daily and monthly usage files.
+
+    The checkpoint commits the batch. A failure before it truncates the rows already appended
+    and returns the snapshot to the next batch, so a retry neither loses nor double counts usage;
+    after a crash, recovery or the next batch in shared mode rolls back to the last checkpoint.
+    Files are only replaced after the checkpoint, so they never hold uncommitted rows.
+    """
+    global batch_in_flight, usage_state_loaded
+
+    usage_state = None
+    claimed = None
+    committed = False
+    with profiler.profile_job("batch"):
+        try:
+            with batch_phase("flush"):
+                half_hourly_writer.flush() # make sure every reading so far is on disk
+                if shared_storage():
+                    # Every worker's readings are in the database, take them all
+                    snapshot, claimed = sqlite_storage().claim_readings()
+                    batch_status["meters"] = len(snapshot)
+                    load_committed_usage_state()
+            usage_state = usage_file_state()
+            with batch_phase("daily"):
+                with profiler.profile_job("calculate_daily_usage"):
+                    usage_changes = calculate_daily_usage(meter_registry, snapshot, latest_daily_usage, usage_cube,
+                                                          daily_usage_index=daily_usage_index, reading_store=reading_store)
+                daily_usage_index.refresh()
+            with batch_phase("monthly"):
+                with profiler.profile_job("calculate_monthly_usage"):
+                    calculate_monthly_usage(usage_changes, monthly_usage, latest_monthly_usage, usage_cube)
+                monthly_usage_index.refresh()
+            with batch_phase("archive"):
+                reading_store.append_buffers(snapshot) # idempotent, so a retried batch may archive again
+            with batch_phase("checkpoint"):
+                # Recovery, or the next batch in shared mode, now starts after this snapshot
+                if shared_storage():
+                    usage_state_loaded = usage_file_state()
+                    sqlite_storage().commit_claim(claimed, usage_state_loaded)
+                else:
+                    checkpoint_readings(commit=True)
+                    with readings_lock:
+                        batch_in_flight = False
+                committed = True
+            with batch_phase("compact"):
+                compact_electricity_accounts(meter_registry)
+                if compact_monthly_usage_if_due(monthly_usage):
+                    monthly_usage_index.refresh()
+                    record_usage_state() # the rollback point must be the compacted file
+            with batch_phase("render"):
+                render_usage_snapshots(daily_file, "daily", daily_row_to_reading, daily_usage_index)
+                render_usage_snapshots(monthly_file, "monthly", monthly_row_to_reading, monthly_usage_index)
+            batch_status["state"] = "completed"
+        except Exception as e:
+            batch_status["state"] = "failed"
+            batch_status["error"] = str(e)
+            logger.exception("Batch job failed: %s", e)
+            if not committed:
+                abort_batch(snapshot, usage_state)
+        finally:
+            batch_status["phase"] = None
+            batch_status["finished_at"] = time.time()
+            metrics.batch_runs_total.inc(state=batch_status["state"])
+            invalidate_response_cache()
+            batch_lock.release()
 
 
-# API 5: Stop the server and perform batch jobs for maintenance
 @app.route("/stop_server", methods=["POST"])
 def stop_server():
     """
-    Stop the server for maintenance, clear memory and archive daily, monthly, and batch jobs.
+    Start the nightly batch jobs: archive the day's readings into daily and monthly usage in the background.
+    Every other endpoint keeps serving while the batch runs; readings posted meanwhile count towards the next day.
     ---
     tags:
       - Server Maintenance
     responses:
-      200:
-        description: Server maintenance and archival tasks were completed successfully.
+      202:
+        description: Batch jobs started. Poll /stop_server/status for progress.
         schema:
           type: object
           properties:
             message:
               type: string
               example: "Server is shutting down. We are working on batch jobs. Good Night!"
+      409:
+        description: Conflict. A batch job is already running, in this or another worker.
+    """
+    global meter_readings, batch_in_flight
+
+    with readings_lock:
+        if batch_status["state"] == "running" or not batch_lock.acquire():
+            return jsonify({"message": "Batch jobs are already running."}), HTTPStatus.CONFLICT
+
+        # Swap in a fresh buffer so ingestion carries on while the snapshot is processed
+        swap_started = time.perf_counter()
+        snapshot = meter_readings
+        meter_readings = defaultdict(MeterReadingBuffer)
+        batch_in_flight = not shared_storage()
+        metrics.batch_phase_duration_seconds.set(time.perf_counter() - swap_started, phase="swap")
+
+        batch_status.update(state="running", job="nightly", phase=None, meters=len(snapshot), started_at=time.time(), finished_at=None, error=None)
+
+    threading.Thread(target=run_batch_jobs, args=(snapshot,), name="batch-jobs", daemon=True).start()
+
+    return jsonify({"message": "Server is shutting down. We are working on batch jobs. Good Night!"}), HTTPStatus.ACCEPTED
+
+
+# API 5a: Progress of the nightly batch jobs
+@app.route("/stop_server/status", methods=["GET"])
+def stop_server_status():
+    """
+    Report progress of the nightly batch jobs, or of a backfill started by POST /backfill.
+    ---
+    tags:
+      - Server Maintenance
+    responses:
+      200:
+        description: Current batch job status.
+        schema:
+          type: object
+          properties:
+            state:
+              type: string
+              enum: [idle, running, completed, failed]
+              example: "running"
+            job:
+              type: string
+              enum: [nightly, backfill]
+              example: "nightly"
+            phase:
+              type: string
+              enum: [flush, daily, monthly, archive, checkpoint, compact, render, read, refresh]
+              example: "daily"
+            meters:
+              type: integer
+              description: Number of meters in the snapshot being processed, or requested by a backfill (0 for all).
+              example: 1200
+            started_at:
+              type: number
+              description: Unix time the batch started.
+            finished_at:
+              type: number
+              description: Unix time the batch finished, or null while running.
+            error:
+              type: string
+              description: Error message if the batch failed.
+    """
+    return jsonify(batch_status), 200
+
+
+# API 5b: Service metrics for Prometheus
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Expose service metrics in the Prometheus text format.
+    ---
+    tags:
+      - Server Maintenance
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: |
+          Request counts and latency histograms per route, half-hourly CSV append latency,
+          bytes and rows, the size of today's in-memory readings and the duration of each
+          phase of the last batch job.
+    """
+    buffers = list(meter_readings.values())
+    reading_count = sum(len(buffer) for buffer in buffers)
+    metrics.readings_in_memory.set(reading_count)
+    metrics.readings_in_memory_bytes.set(reading_count * 16) # int64 timestamp + float64 reading
+    metrics.meters_in_memory.set(len(buffers))
+    return Response(metrics.render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+# API 5c: Arm the on-demand profiler and list captured profiles
+@app.route("/profiler", methods=["GET", "POST", "DELETE"])
+def profiler_admin():
+    """
+    Arm, inspect or disarm the on-demand profiler.
+    A single request can also be profiled by sending it with an `X-Profile: sample` or `X-Profile: cprofile` header;
+    its profile Id comes back in the X-Profile-Id response header.
+    ---
+    tags:
+      - Server Maintenance
+    parameters:
+      - in: body
+        name: body
+        required: false
+        description: For POST only.
+        schema:
+          type: object
+          required:
+            - target
+          properties:
+            target:
+              type: string
+              description: A route template (e.g. /meters/daily), "*" for any route, or a batch job (batch, calculate_daily_usage, calculate_monthly_usage).
+              example: "/meters/daily"
+            requests:
+              type: integer
+              description: Number of upcoming requests or job runs to profile.
+              default: 1
+              example: 5
+            mode:
+              type: string
+              enum: [sample, cprofile]
+              description: sample (low-overhead stack sampling, collapsed stacks) or cprofile (deterministic, pstats).
+              default: sample
+    responses:
+      200:
+        description: Armed targets and the kept profiles, newest first.
+        schema:
+          type: object
+          properties:
+            armed:
+              type: object
+              example: {"/meters/daily": {"mode": "sample", "remaining": 5}}
+            profiles:
+              type: array
+              items:
+                type: object
+                properties:
+                  id:
+                    type: integer
+                  name:
+                    type: string
+                    example: "GET /meters/daily"
+                  mode:
+                    type: string
+                  started_at:
+                    type: number
+                  duration_s:
+                    type: number
+                  samples:
+                    type: integer
+                    description: Stack samples, or function calls for cprofile.
+      201:
+        description: The target is armed.
+      400:
+        description: Bad Request. Unknown target or mode, or invalid request count.
     """
-    global acceptAPI
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        target = data.get("target")
+        count = data.get("requests", 1)
+        mode = data.get("mode", "sample")
+
+        targets = {rule.rule for rule in app.url_map.iter_rules()} | set(profiler.jobs) | {profiler.any_route}
+        if target not in targets:
+            return jsonify({"message": "Target must be a route template, '*' or one of: " + ", ".join(profiler.jobs)}), HTTPStatus.BAD_REQUEST
+        if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+            return jsonify({"message": "requests must be a positive integer."}), HTTPStatus.BAD_REQUEST
+        if mode not in profiler.modes:
+            return jsonify({"message": "mode must be one of: " + ", ".join(profiler.modes)}), HTTPStatus.BAD_REQUEST
+
+        profiler.arm(target, count, mode)
+        return jsonify({"message": f"Profiling the next {count} run(s) of {target}."}), HTTPStatus.CREATED
 
-    acceptAPI = False
-    calculate_daily_usage(meter_accounts, meter_readings)
-    calculate_monthly_usage()
-    # time.sleep(5)
-    meter_readings.clear()
-    acceptAPI = True
+    if request.method == "DELETE":
+        profiler.disarm()
 
-    return jsonify({"message": "Server is shutting down. We are working on batch jobs. Good Night!"}), 200
+    armed = {target: {"mode": mode, "remaining": remaining} for target, (mode, remaining) in list(profiler.armed.items())}
+    return jsonify({"armed": armed, "profiles": profiler.list_profiles()}), HTTPStatus.OK
+
+
+# API 5d: Download a captured profile
+@app.route("/profiler/<int:profile_id>", methods=["GET"])
+def get_profile(profile_id):
+    """
+    Download a captured profile.
+    ---
+    tags:
+      - Server Maintenance
+    parameters:
+      - name: profile_id
+        in: path
+        type: integer
+        required: true
+      - name: format
+        in: query
+        type: string
+        enum: [collapsed, pstats, raw]
+        required: false
+        description: collapsed stacks for sample profiles (flamegraph.pl, speedscope); a pstats report or raw marshalled pstats data for cprofile ones. Defaults to the profile's own format.
+    produces:
+      - text/plain
+      - application/octet-stream
+    responses:
+      200:
+        description: The profile.
+      400:
+        description: Bad Request. The format is not available for this profile.
+      404:
+        description: No such profile, or it has been dropped for newer ones.
+    """
+    try:
+        rendered = profiler.render_profile(profile_id, request.args.get("format"))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), HTTPStatus.BAD_REQUEST
+    if rendered is None:
+        return jsonify({"message": f"Profile {profile_id} not found."}), HTTPStatus.NOT_FOUND
+
+    body, mimetype = rendered
+    return Response(body, mimetype=mimetype)
+
+
+# API 5e: Recompute daily and monthly usage for past days
+def run_backfill(start_date, end_date, meter_ids):
+    """Recompute usage from the half-hourly readings, then reload what the API serves from the rewritten files"""
+    try:
+        if shared_storage():
+            with batch_phase("flush"):
+                load_committed_usage_state() # monthly_usage too, the rollup the backfill updates
+        backfill.recompute_usage(meter_registry, monthly_usage, start_date, end_date, meter_ids, phase=batch_phase)
+        with batch_phase("refresh"):
+            record_usage_state() # the rewritten files are the new rollback point
+            reload_usage_state()
+            render_usage_snapshots(daily_file, "daily", daily_row_to_reading, daily_usage_index)
+            render_usage_snapshots(monthly_file, "monthly", monthly_row_to_reading, monthly_usage_index)
+        batch_status["state"] = "completed"
+    except Exception as e:
+        batch_status["state"] = "failed"
+        batch_status["error"] = str(e)
+        logger.exception("Backfill failed: %s", e)
+    finally:
+        batch_status["phase"] = None
+        batch_status["finished_at"] = time.time()
+        invalidate_response_cache()
+        batch_lock.release()
+
+
+@app.route("/backfill", methods=["POST"])
+def start_backfill():
+    """
+    Recompute daily and monthly usage for past days from the stored half-hourly readings, e.g. after corrections.
+    The affected rows of the daily and monthly usage files are replaced atomically; progress is reported by /stop_server/status.
+    ---
+    tags:
+      - Server Maintenance
+    consumes:
+      - application/json
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - start_date
+            - end_date
+          properties:
+            start_date:
+              type: string
+              example: "2024-01-01"
+            end_date:
+              type: string
+              description: Last day to recompute, inclusive. Must be before today (UTC).
+              example: "2024-01-31"
+            meter_ids:
+              type: array
+              description: Only recompute these meters. Defaults to all meters.
+              items:
+                type: string
+              example: ["111-222-333"]
+    responses:
+      202:
+        description: Backfill started. Poll /stop_server/status for progress.
+      400:
+        description: Bad Request. Invalid dates or meter Ids.
+      409:
+        description: Conflict. A batch job or backfill is already running, in this or another worker.
+    """
+    data = request.get_json(silent=True) or {}
+    start_date, end_date, meter_ids = data.get("start_date"), data.get("end_date"), data.get("meter_ids")
+    try:
+        backfill.backfill_days(start_date, end_date)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), HTTPStatus.BAD_REQUEST
+    if meter_ids is not None and (not isinstance(meter_ids, list) or not all(is_valid_meter_id(meter_id) for meter_id in meter_ids)):
+        return jsonify({"message": "meter_ids must be a list of meter Ids (XXX-XXX-XXX)."}), HTTPStatus.BAD_REQUEST
+
+    with readings_lock:
+        if batch_status["state"] == "running" or not batch_lock.acquire():
+            return jsonify({"message": "A batch job is already running."}), HTTPStatus.CONFLICT
+        batch_status.update(state="running", job="backfill", phase=None, meters=len(meter_ids or ()), started_at=time.time(), finished_at=None, error=None)
+
+    threading.Thread(target=run_backfill, args=(start_date, end_date, meter_ids), name="backfill", daemon=True).start()
+
+    return jsonify({"message": f"Recomputing usage from {start_date} to {end_date}."}), HTTPStatus.ACCEPTED
+
+
+# API 6: Get a batch of meter readings from concentrators and gateways
+@app.route('/meter-readings/batch', methods=['POST'])
+def meter_readings_batch():
+    """
+    Post many electricity readings to the server in one request.
+    ---
+    tags:
+      - Meter Readings
+    consumes:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - in: body
+        name: body
+        description: A JSON array of readings, or one JSON reading per line (NDJSON).
+        required: true
+        schema:
+          type: array
+          items:
+            type: object
+            required:
+              - meter_id
+              - date
+              - time
+              - electricity_reading
+            properties:
+              meter_id:
+                type: string
+                description: Meter ID in the format 123-456-789 (digits only).
+              date:
+                type: string
+                description: Date of the reading in YYYY-MM-DD format (e.g., 2020-01-28).
+              time:
+                type: string
+                description: Time of the reading in HH:MM format (e.g., 14:30).
+              electricity_reading:
+                type: string
+                description: The electricity reading value in kWh.
+    responses:
+      202:
+        description: Batch processed. Each item is reported as accepted, duplicate or rejected.
+        schema:
+          type: object
+          properties:
+            accepted:
+              type: integer
+              example: 2
+            duplicates:
+              type: integer
+              description: Readings already received with the same meter, date, time and value, e.g. retries. They are not stored again.
+              example: 0
+            rejected:
+              type: integer
+              example: 1
+            results:
+              type: array
+              items:
+                type: object
+                properties:
+                  index:
+                    type: integer
+                    example: 0
+                  status:
+                    type: string
+                    enum: [accepted, duplicate, rejected]
+                    example: "rejected"
+                  code:
+                    type: string
+                    enum: [not_an_object, unknown_meter, missing_field, invalid_date, invalid_time, invalid_reading, negative_reading, duplicate]
+                    example: "unknown_meter"
+                  error:
+                    type: string
+                    example: "Meter does not exist! Please register first."
+      400:
+        description: Bad Request. The body is not a JSON array or NDJSON.
+      500:
+        description: Internal Server Error.
+    """
+    try:
+        body = request.get_data(as_text=True)
+        if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+            items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            items = json.loads(body)
+    except ValueError:
+        return {"error": "Body must be a JSON array or NDJSON."}, HTTPStatus.BAD_REQUEST
+
+    if not isinstance(items, list):
+        return {"error": "Body must be a JSON array or NDJSON."}, HTTPStatus.BAD_REQUEST
+
+    try:
+        # Validate the whole batch as columns in one pass
+        objects = [item if isinstance(item, dict) else {} for item in items]
+        meter_ids = [item.get('meter_id') for item in objects]
+        dates = [item.get('date') for item in objects]
+        errors, all_timestamps, all_readings = validate_readings(
+            meter_ids, dates, [item.get('time') for item in objects], [item.get('electricity_reading') for item in objects]
+        )
+
+        results = []
+        accepted = []
+        timestamps = []
+        indexes = []
+        for index, item in enumerate(items):
+            error = errors[index]
+            if not isinstance(item, dict):
+                results.append({"index": index, "status": "rejected", "code": "not_an_object", "error": "Reading must be a JSON object."})
+            elif error == "invalid_meter_id" or (error != "missing_field" and meter_ids[index] not in meter_registry):
+                results.append({"index": index, "status": "rejected", "code": "unknown_meter", "error": "Meter does not exist! Please register first."})
+            elif error:
+                results.append({"index": index, "status": "rejected", "code": error, "error": f"Validation failed: {error_messages[error]}"})
+            else:
+                accepted.append(MeterReading(meter_ids[index], dates[index], item['time'], all_readings[index]))
+                timestamps.append(all_timestamps[index])
+                indexes.append(index)
+                results.append({"index": index, "status": "accepted"})
+
+        # Drop readings already received, then queue the rest for the CSV in one go and add them to today's buffer
+        duplicates = 0
+        if accepted:
+            with readings_lock:
+                new = []
+                keys = set() # readings earlier in this request, recorded only once queued
+                for position, (reading, timestamp) in enumerate(zip(accepted, timestamps)):
+                    key = (reading.meter_id, timestamp, reading.electricity_reading)
+                    if key in keys or reading_dedup.check(*key):
+                        results[indexes[position]] = {"index": indexes[position], "status": "duplicate", "code": "duplicate"}
+                        duplicates += 1
+                    else:
+                        keys.add(key)
+                        new.append((reading, timestamp))
+                if new:
+                    seq = half_hourly_writer.enqueue([[reading.meter_id, reading.date, reading.time, reading.electricity_reading] for reading, _ in new])
+                    if not shared_storage():
+                        for reading, timestamp in new:
+                            meter_readings[reading.meter_id].append(timestamp, reading.electricity_reading)
+                    for key in keys:
+                        reading_dedup.record(*key)
+            if new:
+                half_hourly_writer.acknowledge(seq)
+
+        return {
+            "accepted": len(accepted) - duplicates,
+            "duplicates": duplicates,
+            "rejected": len(items) - len(accepted),
+            "results": results
+        }, HTTPStatus.ACCEPTED
+
+    except Exception as e:
+        return {"error": str(e)}, HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+# API 7: Register a batch of meters
+@app.route('/register/batch', methods=['POST'])
+def register_batch():
+    """
+    Register many meters in one request.
+    ---
+    tags:
+      - Meter Management
+    consumes:
+      - application/json
+    parameters:
+      - in: body
+        name: body
+        description: JSON array of meters to register, each in the same shape as /register.
+        required: true
+        schema:
+          type: array
+          items:
+            type: object
+            required:
+              - meter_id
+              - area
+              - region
+              - dwelling_type
+            properties:
+              meter_id:
+                type: string
+                description: Meter ID in the format XXX-XXX-XXX (numbers only).
+              area:
+                type: string
+                description: The area where the meter is located (e.g. "Jurong").
+              region:
+                type: string
+                description: The region where the meter is located (e.g. "West").
+              dwelling_type:
+                type: string
+                description: Type of dwelling (e.g., "apartment", "house").
+    responses:
+      200:
+        description: Batch processed. Each item is reported as registered or rejected.
+        schema:
+          type: object
+          properties:
+            registered:
+              type: integer
+              example: 2
+            rejected:
+              type: integer
+              example: 1
+            results:
+              type: array
+              items:
+                type: object
+                properties:
+                  index:
+                    type: integer
+                    example: 0
+                  meter_id:
+                    type: string
+                    example: "123-456-789"
+                  status:
+                    type: string
+                    example: "rejected"
+                  message:
+                    type: string
+                    example: "This meter is already registered."
+      400:
+        description: Bad Request. The body is not a JSON array.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return jsonify({"message": "Please provide a JSON array of meters."}), HTTPStatus.BAD_REQUEST
+
+    results = []
+    new_accounts = {}
+    for index, item in enumerate(data):
+        meter_id = item.get("meter_id") if isinstance(item, dict) else None
+        result = {"index": index, "meter_id": meter_id, "status": "rejected"}
+        results.append(result)
+
+        if not meter_id or not isinstance(meter_id, str):
+            result["message"] = "Please provide a meter Id, in the format XXX-XXX-XXX (digits only)"
+        elif not is_valid_meter_id(meter_id):
+            result["message"] = "Invalid format. Use format XXX-XXX-XXX (digits only)."
+        elif meter_id in meter_registry or meter_id in new_accounts:
+            result["message"] = "This meter is already registered."
+        elif not item.get("area") or not item.get("region") or not item.get("dwelling_type"):
+            result["message"] = "Please provide a meter Id, area, region, and dwelling type."
+        else:
+            new_accounts[meter_id] = (ElectricityAccount(
+                meter_id=meter_id,
+                area=item.get("area"),
+                region=item.get("region"),
+                dwelling_type=item.get("dwelling_type")
+            ), result)
+
+    # Register every valid meter with a single write
+    registered = save_electricity_accounts_batch_to_file([account for account, _ in new_accounts.values()], meter_registry=meter_registry)
+    registered_ids = {account.meter_id for account in registered}
+    for meter_id, (_, result) in new_accounts.items():
+        if meter_id in registered_ids:
+            result["status"] = "registered"
+            result["message"] = "Meter registered successfully!"
+        else:
+            result["message"] = "This meter is already registered."
+
+    return jsonify({
+        "registered": len(registered),
+        "rejected": len(results) - len(registered),
+        "results": results
+    }), HTTPStatus.OK
+
+
+# API 8: Get today's intraday readings for a specific meter Id
+@app.route('/meters/<meter_id>/today', methods=['GET'])
+def get_today_meter_usage(meter_id):
+    """
+    Get today's intraday reading curve and usage so far, before the nightly batch job runs.
+    ---
+    tags:
+      - Meter Readings
+    parameters:
+      - name: meter_id
+        in: path
+        type: string
+        required: true
+        description: Meter ID in the format 123-456-789 (digits only).
+    responses:
+      200:
+        description: Today's readings ordered by time, and the usage between the first and last of them.
+        schema:
+          type: object
+          properties:
+            meter_id:
+              type: string
+              example: "123-456-789"
+            usage:
+              type: number
+              example: 12.5
+            readings:
+              type: array
+              items:
+                type: object
+                properties:
+                  date:
+                    type: string
+                    example: "2020-01-28"
+                  time:
+                    type: string
+                    example: "14:30"
+                  electricity_reading:
+                    type: number
+                    example: 150.0
+      403:
+        description: Meter does not exist.
+      404:
+        description: No readings received today for the meter.
+    """
+    if meter_id not in meter_registry:
+        return jsonify({"message": "Meter does not exist! Please register first."}), HTTPStatus.FORBIDDEN
+
+    buffer = today_readings(meter_id)
+    if not buffer:
+        return jsonify({"message": f"No readings found today for meter {meter_id}"}), 404
+
+    curve = buffer.curve()
+    readings = []
+    for timestamp, electricity_reading in curve:
+        date, time = MeterReadingBuffer.from_timestamp(timestamp)
+        readings.append({"date": date, "time": time, "electricity_reading": electricity_reading})
+
+    return jsonify({
+        "meter_id": meter_id,
+        "usage": curve[-1][1] - curve[0][1],
+        "readings": readings
+    }), 200
+
+
+def parse_date_range():
+    """Read the from/to query parameters as zero-padded YYYY-MM-DD dates, which compare as strings; either may be omitted"""
+    start_date, end_date = (
+        datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d') if value else None
+        for value in (request.args.get("from"), request.args.get("to"))
+    )
+    if start_date and end_date and start_date > end_date:
+        raise ValueError("from must not be after to")
+    return start_date, end_date
+
+
+# API 9: Get the readings of a specific meter Id between two dates
+@app.route('/meters/<meter_id>/readings', methods=['GET'])
+def get_meter_readings_range(meter_id):
+    """
+    Get the half-hourly readings of a meter between two dates, including today's readings not yet archived.
+    ---
+    tags:
+      - Meter Readings
+    parameters:
+      - name: meter_id
+        in: path
+        type: string
+        required: true
+        description: Meter ID in the format 123-456-789 (digits only).
+      - name: from
+        in: query
+        type: string
+        required: false
+        description: First date to include, YYYY-MM-DD. Defaults to the earliest available.
+      - name: to
+        in: query
+        type: string
+        required: false
+        description: Last date to include, YYYY-MM-DD. Defaults to the latest available.
+    responses:
+      200:
+        description: Readings ordered by time.
+        schema:
+          type: object
+          properties:
+            meter_id:
+              type: string
+              example: "123-456-789"
+            readings:
+              type: array
+              items:
+                type: object
+                properties:
+                  date:
+                    type: string
+                    example: "2020-01-28"
+                  time:
+                    type: string
+                    example: "14:30"
+                  electricity_reading:
+                    type: number
+                    example: 150.0
+      400:
+        description: Bad Request. Invalid from/to dates.
+      403:
+        description: Meter does not exist.
+    """
+    if meter_id not in meter_registry:
+        return jsonify({"message": "Meter does not exist! Please register first."}), HTTPStatus.FORBIDDEN
+
+    try:
+        start_date, end_date = parse_date_range()
+    except ValueError as e:
+        return jsonify({"message": f"Invalid date range, use YYYY-MM-DD: {e}"}), HTTPStatus.BAD_REQUEST
+
+    # Archived days from the columnar partitions, then today's buffer, whose corrections replace archived readings
+    timestamps, readings = reading_store.meter_range(meter_id, start_date, end_date)
+    curve = dict(zip(timestamps.tolist(), readings.tolist()))
+    buffer = today_readings(meter_id)
+    if buffer:
+        for timestamp, electricity_reading in buffer.curve():
+            date = MeterReadingBuffer.from_timestamp(timestamp)[0]
+            if (not start_date or date >= start_date) and (not end_date or date <= end_date):
+                curve[timestamp] = electricity_reading
+
+    results = []
+    for timestamp, electricity_reading in sorted(curve.items()):
+        date, time = MeterReadingBuffer.from_timestamp(timestamp)
+        results.append({"date": date, "time": time, "electricity_reading": electricity_reading})
+
+    return jsonify({"meter_id": meter_id, "readings": results}), 200
+
+
+# API 10: Get the daily usage of a specific meter Id between two dates
+@app.route('/meters/<meter_id>/daily', methods=['GET'])
+@cached_response
+def get_meter_daily_range(meter_id):
+    """
+    Get the daily usage of a meter between two dates.
+    ---
+    tags:
+      - Meter Readings
+    parameters:
+      - name: meter_id
+        in: path
+        type: string
+        required: true
+        description: Meter ID in the format 123-456-789 (digits only).
+      - name: from
+        in: query
+        type: string
+        required: false
+        description: First date to include, YYYY-MM-DD. Defaults to the earliest available.
+      - name: to
+        in: query
+        type: string
+        required: false
+        description: Last date to include, YYYY-MM-DD. Defaults to the latest available.
+    responses:
+      200:
+        description: Daily usage ordered by date.
+        schema:
+          type: object
+          properties:
+            meter_id:
+              type: string
+              example: "123-456-789"
+            readings:
+              type: array
+              items:
+                type: object
+                properties:
+                  date:
+                    type: string
+                    example: "2020-01-28"
+                  usage:
+                    type: number
+                    example: 150.0
+      400:
+        description: Bad Request. Invalid from/to dates.
+      403:
+        description: Meter does not exist.
+    """
+    if meter_id not in meter_registry:
+        return jsonify({"message": "Meter does not exist! Please register first."}), HTTPStatus.FORBIDDEN
+
+    try:
+        start_date, end_date = parse_date_range()
+    except ValueError as e:
+        return jsonify({"message": f"Invalid date range, use YYYY-MM-DD: {e}"}), HTTPStatus.BAD_REQUEST
+
+    rows = daily_usage_index.lookup(meter_id, start_date, end_date)
+    return jsonify({
+        "meter_id": meter_id,
+        "readings": [{"date": row[4], "usage": float(row[5])} for row in rows]
+    }), 200
 
 
 #####################
 # External APIs to Monetize
 #####################
+def prerendered_usage_response(name):
+    """Send the batch job's pre-rendered body for a full-dataset JSON request straight from disk, or None"""
+    if any(key != "region" for key in request.args):
+        return None
+
+    # send_file resolves relative paths against the app's root, the data lives under the working directory
+    path = os.path.abspath(rendered_usage_path(name, request.args.get("region")))
+    if "gzip" in request.accept_encodings and os.path.exists(path + ".gz"):
+        response = send_file(path + ".gz", mimetype="application/json", conditional=True)
+        response.headers["Content-Encoding"] = "gzip"
+    elif os.path.exists(path):
+        response = send_file(path, mimetype="application/json", conditional=True)
+    else:
+        return None
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def usage_readings_response(usage_index, to_reading, file_label):
+    """Build a paginated JSON, NDJSON or CSV response over the latest rows of a daily or monthly usage file"""
+    response_format = request.args.get("format", "json")
+    if response_format not in ("json", "ndjson", "csv"):
+        return jsonify({"message": "Invalid format. Use json, ndjson or csv."}), HTTPStatus.BAD_REQUEST
+
+    limit = request.args.get("limit")
+    if limit is not None:
+        if not limit.isdigit() or not 0 < int(limit) <= max_page_size:
+            return jsonify({"message": f"Invalid limit. Use a number between 1 and {max_page_size}."}), HTTPStatus.BAD_REQUEST
+        limit = int(limit)
+
+    offset = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            offset = int(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except ValueError:
+            return jsonify({"message": "Invalid cursor."}), HTTPStatus.BAD_REQUEST
+
+    if not os.path.exists(usage_index.usage_file):
+        return jsonify({"message": f"{file_label} usage file not found"}), 404
+    # A cursor must point past the header, within the file and at the start of a row
+    if offset is not None and not is_row_start(usage_index.usage_file, offset):
+        return jsonify({"message": "Invalid cursor."}), HTTPStatus.BAD_REQUEST
+
+    rows = usage_index.latest_rows(offset)
+    region = request.args.get("region")
+    if region:
+        rows = ((row, row_offset) for row, row_offset in rows if row[1] == region)
+
+    # Streaming modes yield one row at a time, so memory stays constant
+    if response_format == "ndjson":
+        def generate():
+            for row, _ in islice(rows, limit):
+                yield json.dumps(to_reading(row)) + "\n"
+        return Response(generate(), mimetype="application/x-ndjson")
+
+    if response_format == "csv":
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(["region", "area", "dwelling_type", "date", "usage"])
+            for row, _ in islice(rows, limit):
+                writer.writerow(row[1:6])
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        return Response(generate(), mimetype="text/csv")
+
+    # JSON: the whole file, or one page when a limit is given
+    readings = []
+    next_cursor = None
+    last_offset = None
+    for row, row_offset in rows:
+        if limit is not None and len(readings) == limit:
+            next_cursor = base64.urlsafe_b64encode(str(last_offset).encode()).decode()
+            break
+        readings.append(to_reading(row))
+        last_offset = row_offset
+
+    if not readings:
+        return jsonify({"message": f"No readings found."}), 404
+
+    body = {"readings": readings}
+    if limit is not None:
+        body["next_cursor"] = next_cursor
+    return jsonify(body), 200
+
+
 # External API 1: Get all daily readings for all meters
 @app.route('/meters/daily', methods=['GET'])
+@cached_response
 def get_daily_readings():
     """
     Get daily usage readings for all meters.
     ---
     tags:
       - Meter Readings
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Page size (1-10000). When given, the response carries a next_cursor for the following page.
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: Opaque cursor taken from next_cursor of the previous page.
+      - name: format
+        in: query
+        type: string
+        enum: [json, ndjson, csv]
+        required: false
+        description: json (default) returns one document; ndjson and csv stream the rows.
+      - name: region
+        in: query
+        type: string
+        required: false
+        description: Only return readings of this region (e.g. "West").
     responses:
       200:
         description: Daily readings retrieved successfully.
         schema:
           type: object
           properties:
+            next_cursor:
+              type: string
+              description: Cursor for the next page, or null on the last page. Only present when limit is given.
             readings:
               type: array
               items:
@@ -510,22 +1729,22 @@ def get_daily_readings():
                   usage:
                     type: string
                     example: "150"
-      404:
-        description: No readings found or the daily usage file is not available.
+      400:
+        description: Bad Request. Invalid limit, format or cursor.
         schema:
           type: object
           properties:
             message:
               type: string
-              example: "No readings found."
-      503:
-        description: Service unavailable. The server is temporarily offline for maintenance.
+              example: "Invalid cursor."
+      404:
+        description: No readings found or the daily usage file is not available.
         schema:
           type: object
           properties:
             message:
               type: string
-              example: "The server is temporarily offline for maintenance."
+              example: "No readings found."
       500:
         description: Internal server error.
         schema:
@@ -535,43 +1754,43 @@ def get_daily_readings():
               type: string
               example: "Error reading file: [error details]"
     """
-    if not acceptAPI:
-        return jsonify({"message": f"The server is temporarily offline for maintenance."}), HTTPStatus.SERVICE_UNAVAILABLE
-    
     try:
-        with open('archived_data/daily_usage.csv', 'r', newline='') as file:
-            reader = csv.reader(file)
-            readings = []
-
-            for row in reader:
-                readings.append({
-                    "region":row[1],
-                    "area": row[2],
-                    "dwelling_type": row[3],
-                    "date": row[4],
-                    "usage": row[5]
-                }), 200
-
-            if readings:
-                return jsonify({
-                    "readings": readings
-                }), 200
-            return jsonify({"message": f"No readings found."}), 404
-
-    except FileNotFoundError:
-        return jsonify({"message": "Daily usage file not found"}), 404
+        return prerendered_usage_response("daily") or usage_readings_response(daily_usage_index, daily_row_to_reading, "Daily")
     except Exception as e:
         return jsonify({"message": f"Error reading file: {str(e)}"}), 500
 
     
 # External API 2: Get all monthly readings for all meters
 @app.route('/meters/monthly', methods=['GET'])
+@cached_response
 def get_monthly_readings():
     """
     Get monthly usage readings for all meters.
     ---
     tags:
       - Meter Readings
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Page size (1-10000). When given, the response carries a next_cursor for the following page.
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: Opaque cursor taken from next_cursor of the previous page.
+      - name: format
+        in: query
+        type: string
+        enum: [json, ndjson, csv]
+        required: false
+        description: json (default) returns one document; ndjson and csv stream the rows.
+      - name: region
+        in: query
+        type: string
+        required: false
+        description: Only return readings of this region (e.g. "West").
     responses:
       200:
         description: Monthly readings retrieved successfully.
@@ -580,6 +1799,9 @@ def get_monthly_readings():
             schema:
               type: object
               properties:
+                next_cursor:
+                  type: string
+                  description: Cursor for the next page, or null on the last page. Only present when limit is given.
                 readings:
                   type: array
                   items:
@@ -597,8 +1819,8 @@ def get_monthly_readings():
                       usage:
                         type: number
                         example: 150.0
-      404:
-        description: No readings found or the monthly usage file is not available.
+      400:
+        description: Bad Request. Invalid limit, format or cursor.
         content:
           application/json:
             schema:
@@ -606,9 +1828,9 @@ def get_monthly_readings():
               properties:
                 message:
                   type: string
-                  example: "No readings found."
-      503:
-        description: Service unavailable. The server is temporarily offline for maintenance.
+                  example: "Invalid cursor."
+      404:
+        description: No readings found or the monthly usage file is not available.
         content:
           application/json:
             schema:
@@ -616,7 +1838,7 @@ def get_monthly_readings():
               properties:
                 message:
                   type: string
-                  example: "The server is temporarily offline for maintenance."
+                  example: "No readings found."
       500:
         description: Internal server error.
         content:
@@ -628,35 +1850,73 @@ def get_monthly_readings():
                   type: string
                   example: "Error reading file: [error details]"
     """
-    if not acceptAPI:
-        return jsonify({"message": f"The server is temporarily offline for maintenance."}), HTTPStatus.SERVICE_UNAVAILABLE
-    
     try:
-        with open('archived_data/monthly_usage.csv', 'r', newline='') as file:
-            reader = csv.reader(file)
-            readings = []
-
-            for row in reader:
-                    readings.append({
-                      "region": row[1],
-                      "area": row[2],
-                      "dwelling_type": row[3],
-                      "date": row[4],
-                      "usage": float(row[5])
-                  })
-
-            if readings:
-                return jsonify({
-                    "readings": readings
-                }), 200
-            return jsonify({"message": f"No readings found."}), 404
-
-    except FileNotFoundError:
-        return jsonify({"message": "Monthly usage file not found"}), 404
+        return prerendered_usage_response("monthly") or usage_readings_response(monthly_usage_index, monthly_row_to_reading, "Monthly")
     except Exception as e:
         return jsonify({"message": f"Error reading file: {str(e)}"}), 500
       
 
+# External API 3: Aggregated usage by region, area and dwelling type
+@app.route('/meters/aggregate', methods=['GET'])
+@cached_response
+def get_aggregated_usage():
+    """
+    Get total, mean and count of usage per day or month, grouped by any combination of region, area and dwelling type.
+    ---
+    tags:
+      - Meter Readings
+    parameters:
+      - name: period
+        in: query
+        type: string
+        enum: [day, month]
+        required: false
+        description: Group by day (default) or month. Monthly mean and count are per meter.
+      - name: group_by
+        in: query
+        type: string
+        required: false
+        description: Comma-separated dimensions out of region, area, dwelling_type (e.g. "region,dwelling_type"). Empty for totals only.
+    responses:
+      200:
+        description: One entry per period and group.
+        schema:
+          type: object
+          properties:
+            aggregates:
+              type: array
+              items:
+                type: object
+                properties:
+                  period:
+                    type: string
+                    example: "2020-01-28"
+                  region:
+                    type: string
+                    example: "West"
+                  total:
+                    type: number
+                    example: 1500.0
+                  count:
+                    type: integer
+                    example: 10
+                  mean:
+                    type: number
+                    example: 150.0
+      400:
+        description: Bad Request. Unknown period or dimension.
+    """
+    period = request.args.get("period", "day")
+    if period not in ("day", "month"):
+        return jsonify({"message": "Invalid period. Use day or month."}), HTTPStatus.BAD_REQUEST
+
+    group_by = [dimension for dimension in request.args.get("group_by", "").split(",") if dimension]
+    if any(dimension not in rollup_dimensions for dimension in group_by):
+        return jsonify({"message": f"Invalid group_by. Use any of {', '.join(rollup_dimensions)}."}), HTTPStatus.BAD_REQUEST
+
+    return jsonify({"aggregates": usage_cube.query(period, set(group_by))}), 200
+
+
 # Run the Flask app
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,282 @@
+"""
+Recompute daily and monthly usage for past days from the half-hourly readings, e.g. after
+readings were corrected or the daily logic changed, and replace the affected rows of
+daily_usage.csv and monthly_usage.csv atomically. With the server stopped:
+
+    python backfill.py --start 2024-01-01 --end 2024-03-31
+    python backfill.py --start 2024-02-01 --end 2024-02-29 --meters 111-222-333,111-222-334
+
+A running server does the same through POST /backfill.
+"""
+import os
+import csv
+import time
+import argparse
+from contextlib import nullcontext
+from datetime import datetime
+from operator import itemgetter
+
+from models.meter_reading_buffer import MeterReadingBuffer
+from models.meter_registry import MeterRegistry
+from validation import date_seconds
+from utils import (half_hourly_readings_csv_filepath, daily_file, batch_workers, shared_storage,
+                   sqlite_storage, compact_monthly_usage, load_electricity_accounts_from_file, load_monthly_usage_rollup,
+                   configure_logging, logger)
+from process_pool import run_in_process_pool
+
+
+backfill_chunk_rows = 100000 # rows parsed and folded at a time, per worker
+backfill_min_bytes_per_worker = 8 * 1024 * 1024 # smaller CSVs are read in-process
+
+
+def csv_byte_ranges(path, parts):
+    """Split a CSV after its header into up to `parts` (start, end) byte ranges that begin on line boundaries"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as file:
+        file.readline()  # skip header
+        bounds = [file.tell()]
+        first = bounds[0]
+        for part in range(1, parts):
+            file.seek(max(first + (size - first) * part // parts - 1, bounds[-1]))
+            file.readline()  # on to the start of the next line
+            bounds.append(max(file.tell(), bounds[-1]))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def fold_readings(groups, readings, first_day, last_day, meter_ids):
+    """Keep the first and last reading of every (meter, day) in range, as [first ts, reading, last ts, reading].
+
+    Readings later in the input win timestamp ties, so corrections appended to the log override.
+    """
+    for meter_id, timestamp, reading in readings:
+        day = timestamp // 86400
+        if day < first_day or day > last_day or (meter_ids is not None and meter_id not in meter_ids):
+            continue
+        key = (meter_id, day)
+        group = groups.get(key)
+        if group is None:
+            groups[key] = [timestamp, reading, timestamp, reading]
+            continue
+        if timestamp <= group[0]:
+            group[0], group[1] = timestamp, reading
+        if timestamp >= group[2]:
+            group[2], group[3] = timestamp, reading
+
+
+def _csv_readings(lines):
+    for row in csv.reader(line.decode() for line in lines):
+        try:
+            meter_id, date, time_, reading = row
+            yield meter_id, MeterReadingBuffer.to_timestamp(date, time_), float(reading)
+        except ValueError:
+            continue  # blank, torn or malformed row
+
+
+def first_and_last_readings(task):
+    """Pool task: fold one byte range of the half-hourly CSV, streamed backfill_chunk_rows lines at a time"""
+    path, start, end, first_day, last_day, meter_ids = task
+    groups = {}
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            lines = []
+            for line in file:
+                lines.append(line)
+                remaining -= len(line)
+                if remaining <= 0 or len(lines) >= backfill_chunk_rows:
+                    break
+            if not lines:
+                break
+            fold_readings(groups, _csv_readings(lines), first_day, last_day, meter_ids)
+    return groups
+
+
+def read_first_and_last_readings(first_day, last_day, meter_ids, workers):
+    """(meter_id, day) -> [first ts, reading, last ts, reading] over every stored reading in range"""
+    if shared_storage():
+        groups = {}
+        for chunk in sqlite_storage().iter_readings(first_day * 86400, (last_day + 1) * 86400, backfill_chunk_rows):
+            fold_readings(groups, chunk, first_day, last_day, meter_ids)
+        return groups
+
+    path = half_hourly_readings_csv_filepath
+    if not os.path.exists(path):
+        return {}
+    # The CSV is in arrival order, not date order, so workers split it by bytes rather than by month
+    workers = min(workers or batch_workers, os.path.getsize(path) // backfill_min_bytes_per_worker) or 1
+    ranges = csv_byte_ranges(path, workers)
+    partials = run_in_process_pool(first_and_last_readings, [(path, start, end, first_day, last_day, meter_ids) for start, end in ranges])
+
+    # Merge in file order, so ties still go to the later reading
+    groups = partials[0] if partials else {}
+    for partial in partials[1:]:
+        for key, (first_timestamp, first_reading, last_timestamp, last_reading) in partial.items():
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [first_timestamp, first_reading, last_timestamp, last_reading]
+                continue
+            if first_timestamp <= group[0]:
+                group[0], group[1] = first_timestamp, first_reading
+            if last_timestamp >= group[2]:
+                group[2], group[3] = last_timestamp, last_reading
+    return groups
+
+
+def replace_daily_usage_rows(new_rows, start_date, end_date, meter_ids):
+    """Swap the daily rows in range for new_rows in one atomic rewrite; returns (rows replaced, rows kept).
+
+    Only the rows of a meter and day that new_rows recompute are replaced. A row in range
+    without readings to recompute it from, e.g. from before the readings were stored, is kept.
+    Rows stay in date order, so the last row of a meter is still its latest day.
+    """
+    new_rows = sorted(new_rows, key=itemgetter(4, 0))
+    recomputed = {(row[0], row[4]) for row in new_rows}
+    replaced = []
+    kept = 0
+    pending = 0
+
+    tmp_file = daily_file + ".tmp"
+    with open(tmp_file, 'w', newline='') as target:
+        writer = csv.writer(target)
+        writer.writerow(["Meter_id", "Region", "Area", "Dwelling_type", "Date", "Daily_Usage (kWh)"])
+        if os.path.exists(daily_file):
+            with open(daily_file, 'r', newline='') as source:
+                reader = csv.reader(source)
+                next(reader, None)  # skip header
+                for row in reader:
+                    if not row:
+                        continue
+                    date = row[4]
+                    if start_date <= date <= end_date and (meter_ids is None or row[0] in meter_ids):
+                        if (row[0], date) in recomputed:
+                            replaced.append(row)
+                            continue
+                        kept += 1
+                    while pending < len(new_rows) and new_rows[pending][4] <= date:
+                        writer.writerow(new_rows[pending])
+                        pending += 1
+                    writer.writerow(row)
+        writer.writerows(new_rows[pending:])
+        target.flush()
+        os.fsync(target.fileno())
+    os.replace(tmp_file, daily_file)
+    return replaced, kept
+
+
+def recompute_monthly_usage(monthly_usage, affected, workers):
+    """Re-sum the affected (meter_id, month) pairs from the daily file into the rollup and rewrite the monthly file"""
+    sums = {}
+    months = {}
+    with open(daily_file, 'r', newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None)  # skip header
+        for row in reader:
+            if not row:
+                continue
+            month = months.get(row[4])
+            if month is None:
+                month = months[row[4]] = datetime.strptime(row[4], '%Y-%m-%d').strftime("%Y-%b")
+            key = (row[0], month)
+            if key in affected:
+                total = sums.get(key)
+                if total is None:
+                    total = sums[key] = ([row[0], row[1], row[2], row[3], month], {})
+                total[1][row[4]] = float(row[5]) # a later row for the same day supersedes the earlier one
+
+    for key in affected:
+        if key in sums:
+            row, days = sums[key]
+            monthly_usage[key] = row + [sum(days.values())]
+        else:
+            monthly_usage.pop(key, None)
+    compact_monthly_usage(monthly_usage, workers)
+
+
+def backfill_days(start_date, end_date):
+    """(first, last) epoch day of a range that can be recomputed; ValueError if it can't"""
+    start_seconds, end_seconds = date_seconds(start_date), date_seconds(end_date)
+    if start_seconds is None or end_seconds is None or start_seconds > end_seconds:
+        raise ValueError("start_date and end_date must be YYYY-MM-DD dates, start_date first.")
+    first_day, last_day = start_seconds // 86400, end_seconds // 86400
+    if last_day >= int(time.time()) // 86400:
+        raise ValueError("Only days before today (UTC) can be recomputed; today's readings belong to the next batch job.")
+    return first_day, last_day
+
+
+def recompute_usage(meter_registry, monthly_usage, start_date, end_date, meter_ids=None, workers=None, phase=None):
+    """Recompute daily and monthly usage from the half-hourly readings from start_date to end_date inclusive.
+
+    meter_ids limits it to some meters (all if None). monthly_usage is the (meter_id, month)
+    rollup and is updated in place. phase(name) may return a context manager to report progress.
+    Raises ValueError for an invalid range. Returns a summary of what changed.
+    """
+    phase = phase or (lambda name: nullcontext())
+    first_day, last_day = backfill_days(start_date, end_date)
+    start_date, end_date = (time.strftime("%Y-%m-%d", time.gmtime(day * 86400)) for day in (first_day, last_day))
+    meter_ids = frozenset(meter_ids) if meter_ids else None
+
+    with phase("read"):
+        groups = read_first_and_last_readings(first_day, last_day, meter_ids, workers)
+
+    with phase("daily"):
+        dates = {}
+        new_rows = []
+        unknown_meters = set()
+        for (meter_id, day), (_, first_reading, _, last_reading) in groups.items():
+            account = meter_registry.get(meter_id)
+            if account is None:
+                unknown_meters.add(meter_id)
+                continue
+            date = dates.get(day)
+            if date is None:
+                date = dates[day] = time.strftime("%Y-%m-%d", time.gmtime(day * 86400))
+            new_rows.append([meter_id, account.region, account.area, account.dwelling_type, date, last_reading - first_reading])
+        replaced, kept = replace_daily_usage_rows(new_rows, start_date, end_date, meter_ids)
+        if kept:
+            logger.warning("%d daily row(s) in range have no readings to recompute them from and were kept.", kept)
+
+    with phase("monthly"):
+        affected = {(row[0], datetime.strptime(row[4], '%Y-%m-%d').strftime("%Y-%b")) for row in replaced + new_rows}
+        recompute_monthly_usage(monthly_usage, affected, workers)
+
+    summary = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "daily_rows_replaced": len(replaced),
+        "daily_rows_written": len(new_rows),
+        "daily_rows_kept": kept,
+        "months_recomputed": len(affected),
+        "unknown_meters": len(unknown_meters),
+    }
+    logger.info("Recomputed usage from %s to %s: %d daily row(s) replaced by %d, %d meter month(s) recomputed.",
+                start_date, end_date, len(replaced), len(new_rows), len(affected))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start", required=True, help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="last day, YYYY-MM-DD, before today")
+    parser.add_argument("--meters", help="comma-separated meter Ids, default all")
+    parser.add_argument("--workers", type=int, help=f"worker processes, default {batch_workers}")
+    args = parser.parse_args()
+
+    # Run as backfill, not __main__, so the pool workers can unpickle its tasks
+    import backfill
+
+    listener = configure_logging()
+    try:
+        meter_registry = MeterRegistry(load_electricity_accounts_from_file())
+        meter_ids = args.meters.split(",") if args.meters else None
+        summary = backfill.recompute_usage(meter_registry, load_monthly_usage_rollup(), args.start, args.end, meter_ids, args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        listener.stop()
+    print(summary)
+
+
+if __name__ == "__main__":
+    main()
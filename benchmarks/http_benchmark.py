@@ -0,0 +1,291 @@
+"""
+HTTP load test for the ingestion and query endpoints.
+
+Starts the Flask app on a scratch copy of archived_data (or targets --url), registers
+--meters meters, then has --concurrency workers send a weighted mix of requests for
+--duration seconds: half-hourly readings, /latest lookups and bulk reads. Reports
+throughput, p50/p95/p99 latency and error rate per endpoint, and writes them as JSON
+so runs can be compared across commits:
+
+    python benchmarks/http_benchmark.py --output before.json
+    python benchmarks/http_benchmark.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# endpoint label -> weight in the request mix
+default_mix = {
+    "POST /meter-readings": 70,
+    "GET /meters/<id>/daily/latest": 10,
+    "GET /meters/<id>/monthly/latest": 10,
+    "GET /meters/daily": 5,
+    "GET /meters/monthly": 5,
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port):
+    """Run app.py on a scratch copy of archived_data; returns (process, scratch dir)"""
+    workdir = tempfile.mkdtemp(prefix="meter-bench-")
+    shutil.copytree(os.path.join(repo_root, "archived_data"), os.path.join(workdir, "archived_data"))
+    env = dict(os.environ, PYTHONPATH=repo_root)
+    process = subprocess.Popen(
+        [sys.executable, "-c", f"import app; app.app.run(port={port}, threaded=True)"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return process, workdir
+
+
+def wait_until_up(base_url, timeout=30):
+    """Wait for the server to answer at all; "/" is served by every version of the app"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + "/", timeout=1).read()
+            return
+        except urllib.error.HTTPError:
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not come up within {timeout}s")
+
+
+def call(base_url, method, path, data=None, json_body=None):
+    """Send one request; returns (status, seconds)"""
+    headers = {}
+    body = None
+    if json_body is not None:
+        body = json.dumps(json_body).encode()
+        headers["Content-Type"] = "application/json"
+    elif data is not None:
+        body = urllib.parse.urlencode(data).encode()
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+    request = urllib.request.Request(base_url + path, data=body, method=method, headers=headers)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        status = 0
+    return status, time.perf_counter() - started
+
+
+class Workload:
+    """Simulated fleet: every meter posts cumulative readings on consecutive half-hour slots"""
+
+    def __init__(self, meter_count, date):
+        self.meter_ids = [f"{900 + i // 1000000:03d}-{i // 1000 % 1000:03d}-{i % 1000:03d}" for i in range(meter_count)]
+        self.date = date
+        self._slots = [0] * meter_count
+        self._totals = [0.0] * meter_count
+        self._lock = threading.Lock()
+
+    def next_reading(self):
+        index = random.randrange(len(self.meter_ids))
+        with self._lock:
+            slot = self._slots[index] % 48
+            self._slots[index] += 1
+            self._totals[index] += random.uniform(0.1, 2.0)
+            total = self._totals[index]
+        return {
+            "meter_id": self.meter_ids[index],
+            "date": self.date,
+            "time": f"{slot // 2:02d}:{slot % 2 * 30:02d}",
+            "electricity_reading": f"{total:.3f}",
+        }
+
+    def random_meter(self):
+        return random.choice(self.meter_ids)
+
+
+def send(base_url, label, workload):
+    if label == "POST /meter-readings":
+        return call(base_url, "POST", "/meter-readings", data=workload.next_reading())
+    if label == "GET /meters/<id>/daily/latest":
+        return call(base_url, "GET", f"/meters/{workload.random_meter()}/daily/latest")
+    if label == "GET /meters/<id>/monthly/latest":
+        return call(base_url, "GET", f"/meters/{workload.random_meter()}/monthly/latest")
+    if label == "GET /meters/daily":
+        return call(base_url, "GET", "/meters/daily")
+    if label == "GET /meters/monthly":
+        return call(base_url, "GET", "/meters/monthly")
+    raise ValueError(f"Unknown endpoint {label}")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def milliseconds(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def summarize(samples, elapsed):
+    """samples: label -> [(status, seconds)]; an endpoint that got no requests has no latencies"""
+    results = {}
+    for label, values in sorted(samples.items()):
+        latencies = sorted(seconds for _, seconds in values)
+        # 404 is a normal answer for a meter without usage yet
+        errors = sum(1 for status, _ in values if status == 0 or status >= 500 or status in (400, 403))
+        results[label] = {
+            "requests": len(values),
+            "throughput_rps": len(values) / elapsed,
+            "error_rate": errors / len(values) if values else 0.0,
+            "p50_ms": milliseconds(percentile(latencies, 0.50)),
+            "p95_ms": milliseconds(percentile(latencies, 0.95)),
+            "p99_ms": milliseconds(percentile(latencies, 0.99)),
+        }
+    return results
+
+
+def run(base_url, meter_count, concurrency, duration, mix, run_batch):
+    workload = Workload(meter_count, time.strftime("%Y-%m-%d"))
+
+    # Register the fleet up front, in chunks, or one by one on a server without /register/batch
+    accounts = [{"meter_id": meter_id, "area": "Jurong", "region": "West", "dwelling_type": "HDB"} for meter_id in workload.meter_ids]
+    for start in range(0, meter_count, 5000):
+        chunk = accounts[start:start + 5000]
+        status, _ = call(base_url, "POST", "/register/batch", json_body=chunk)
+        if status == 404:
+            for account in accounts[start:]:
+                call(base_url, "POST", "/register", json_body=account)
+            break
+
+    labels = list(mix)
+    weights = [mix[label] for label in labels]
+    samples = {label: [] for label in labels}
+    samples_lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def worker():
+        local = {label: [] for label in labels}
+        while time.time() < deadline:
+            label = random.choices(labels, weights)[0]
+            local[label].append(send(base_url, label, workload))
+        with samples_lock:
+            for label, values in local.items():
+                samples[label].extend(values)
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.time() - started
+
+    results = {"endpoints": summarize(samples, elapsed)}
+
+    if run_batch:
+        status, seconds = call(base_url, "POST", "/stop_server")
+        batch_started = time.time()
+        while True:
+            with urllib.request.urlopen(base_url + "/stop_server/status") as response:
+                state = json.load(response)["state"]
+            if state != "running":
+                break
+            time.sleep(0.05)
+        results["batch"] = {"state": state, "seconds": time.time() - batch_started + seconds}
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=repo_root, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_ms(value):
+    return f"{'-':>8}" if value is None else f"{value:>8.2f}"
+
+
+def print_report(results, baseline=None):
+    print(f"{'endpoint':34} {'reqs':>7} {'rps':>9} {'err%':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label, stats in results["endpoints"].items():
+        line = (f"{label:34} {stats['requests']:>7} {stats['throughput_rps']:>9.1f} {stats['error_rate'] * 100:>6.2f}"
+                f" {format_ms(stats['p50_ms'])} {format_ms(stats['p95_ms'])} {format_ms(stats['p99_ms'])}")
+        old = (baseline or {}).get("endpoints", {}).get(label)
+        if old and old['throughput_rps'] and old['p99_ms'] and stats['p99_ms'] is not None:
+            line += f"   rps {(stats['throughput_rps'] / old['throughput_rps'] - 1) * 100:+.1f}%, p99 {(stats['p99_ms'] / old['p99_ms'] - 1) * 100:+.1f}%"
+        print(line)
+    if "batch" in results:
+        print(f"batch job: {results['batch']['state']} in {results['batch']['seconds']:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark a running server instead of starting one")
+    parser.add_argument("--meters", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--mix", help='JSON endpoint weights, e.g. \'{"POST /meter-readings": 1}\'')
+    parser.add_argument("--batch", action="store_true", help="run /stop_server afterwards and time the batch job")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to diff against")
+    args = parser.parse_args()
+
+    mix = json.loads(args.mix) if args.mix else default_mix
+    process = workdir = None
+    base_url = args.url
+    if not base_url:
+        port = free_port()
+        process, workdir = start_server(port)
+        base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_up(base_url)
+        results = run(base_url, args.meters, args.concurrency, args.duration, mix, args.batch)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results["meta"] = {
+        "commit": git_commit(),
+        "meters": args.meters,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "mix": mix,
+        "timestamp": time.time(),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Startup check: how long `import app` takes in a fresh interpreter, on a scratch copy of
+archived_data, and which imports dominate. Exits 1 when the median is over --target-ms, so it
+can gate CI:
+
+    python benchmarks/import_time.py --runs 5 --target-ms 450
+
+With --meters, archived_data is generated instead: that many registered meters with --days
+days of daily usage each, ending yesterday, and their monthly usage, to see how startup
+scales with the usage files:
+
+    python benchmarks/import_time.py --meters 10000 --days 90 --target-ms 5000
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import date, timedelta
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported lazily or not at all by a worker starting up
+deferred_modules = ("numpy", "flasgger", "jsonschema", "multiprocessing")
+
+
+def generate_dataset(archived_dir, meters, days):
+    """Write accounts, daily usage and monthly usage for a fleet of meters, in the formats app.py reads"""
+    os.makedirs(archived_dir)
+    meter_ids = [f"{900 + i // 1000000:03d}-{i // 1000 % 1000:03d}-{i % 1000:03d}" for i in range(meters)]
+    accounts = [(meter_id, random.choice(["West", "East", "North"]), random.choice(["Jurong", "Tampines", "Woodlands"]),
+                 random.choice(["1 room", "2 room", "HDB"])) for meter_id in meter_ids]
+    with open(os.path.join(archived_dir, "electricity_accounts.json"), "w") as file:
+        json.dump([{"meter_id": meter_id, "area": area, "region": region, "dwelling_type": dwelling_type}
+                   for meter_id, region, area, dwelling_type in accounts], file)
+
+    first_day = date.today() - timedelta(days=days)
+    monthly = {}
+    with open(os.path.join(archived_dir, "daily_usage.csv"), "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Meter_id", "Region", "Area", "Dwelling_type", "Date", "Daily_Usage (kWh)"])
+        for offset in range(days):
+            day = first_day + timedelta(days=offset)
+            month = day.strftime("%Y-%b")
+            for account in accounts:
+                usage = round(random.uniform(5, 25), 3)
+                writer.writerow([*account, day.isoformat(), usage])
+                monthly[(account, month)] = monthly.get((account, month), 0.0) + usage
+    with open(os.path.join(archived_dir, "monthly_usage.csv"), "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Meter_id", "Region", "Area", "Dwelling_type", "Month", "Monthly_Usage (kWh)"])
+        writer.writerows([*account, month, usage] for (account, month), usage in monthly.items())
+
+
+def measure_import(workdir):
+    """One fresh `import app`; returns (total ms, {module: cumulative ms}, modules loaded eagerly)"""
+    code = (
+        "import sys, app; "
+        # Lazily imported modules sit in sys.modules as placeholders of another type until first used
+        "print(','.join(name for name in %r if type(sys.modules.get(name)) is type(sys)))"
+        % (deferred_modules,)
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=workdir, env=dict(os.environ, PYTHONPATH=repo_root), capture_output=True, text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(f"import app failed:\n{result.stderr[-2000:]}")
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            cumulative[fields[2].strip()] = int(fields[1]) / 1000
+        except (IndexError, ValueError):
+            continue # the header line
+    loaded = [name for name in result.stdout.strip().split(",") if name]
+    return cumulative["app"], cumulative, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target-ms", type=float, default=450, help="fail if the median import time is above this")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--meters", type=int, default=0, help="generate archived_data for this many meters instead of copying it")
+    parser.add_argument("--days", type=int, default=90, help="days of daily usage per generated meter")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="meter-import-")
+    try:
+        if args.meters:
+            generate_dataset(os.path.join(workdir, "archived_data"), args.meters, args.days)
+            measure_import(workdir) # the first start renders the usage snapshots, later ones reuse them
+        else:
+            shutil.copytree(os.path.join(repo_root, "archived_data"), os.path.join(workdir, "archived_data"))
+        runs = [measure_import(workdir) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    median = statistics.median(total for total, _, _ in runs)
+    _, cumulative, loaded = runs[-1]
+    print(f"import app: median {median:.0f} ms over {args.runs} run(s), target {args.target_ms:.0f} ms")
+    for name, ms in sorted(cumulative.items(), key=lambda item: -item[1])[1:args.top + 1]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    failed = False
+    if loaded:
+        print(f"FAIL: imported at startup, expected to load lazily: {', '.join(loaded)}")
+        failed = True
+    if median > args.target_ms:
+        print(f"FAIL: import time above the {args.target_ms:.0f} ms target")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Build static/openapi.json, the Swagger spec served at /apispec_1.json, from the YAML in the
+route docstrings of app.py. Run it after changing a route or its docstring:
+
+    python build_openapi.py
+    python build_openapi.py --check   # exit 1 if static/openapi.json is out of date
+"""
+import argparse
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+repo_root = os.path.dirname(os.path.abspath(__file__))
+spec_path = os.path.join(repo_root, 'static', 'openapi.json')
+
+
+def build_spec():
+    """Have flasgger build the spec from a throwaway instance of the app"""
+    # Start the app in a scratch directory so its startup doesn't touch archived_data
+    workdir = tempfile.mkdtemp(prefix="meter-openapi-")
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True) # runs after the app's own exit hooks
+    os.makedirs(os.path.join(workdir, 'archived_data'))
+    os.chdir(workdir)
+    os.environ["METER_LIVE_OPENAPI"] = "1"
+    sys.path.insert(0, repo_root)
+
+    import app
+    return app.app.test_client().get("/apispec_1.json").get_json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="don't write, fail if the spec is out of date")
+    args = parser.parse_args()
+
+    text = json.dumps(build_spec(), indent=2, sort_keys=True) + "\n"
+
+    if args.check:
+        current = open(spec_path).read() if os.path.exists(spec_path) else None
+        if current != text:
+            print(f"{spec_path} is out of date, run python build_openapi.py")
+            sys.exit(1)
+        print(f"{spec_path} is up to date.")
+        return
+
+    os.makedirs(os.path.dirname(spec_path), exist_ok=True)
+    with open(spec_path, 'w') as file:
+        file.write(text)
+    print(f"Wrote {spec_path}.")
+
+
+if __name__ == "__main__":
+    main()
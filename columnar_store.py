@@ -0,0 +1,245 @@
+import os
+import csv
+import struct
+import shutil
+import threading
+from bisect import bisect_left, bisect_right
+
+from lazy_import import lazy_import
+from models.meter_reading_buffer import MeterReadingBuffer
+from process_lock import ProcessLock
+
+np = lazy_import('numpy') # loaded on first use, not at server startup
+
+
+columnar_root = os.path.join('archived_data', 'half_hourly')
+
+# Partition file: header, then meter codes (uint32, padded to 8 bytes), timestamps (int64) and readings (float64)
+partition_header = struct.Struct('<4sHxxQ') # magic, version, row count
+partition_magic = b'MRCP'
+
+
+class ColumnarReadingStore:
+    """Half-hourly readings stored as one columnar binary partition per UTC day.
+
+    Meter Ids are dictionary-encoded into uint32 codes shared by all partitions (meters.txt,
+    code = line number). Other processes may add codes, so new ones are assigned under a file
+    lock after reading what was appended since. Rows inside a partition are sorted by
+    (meter code, timestamp), so one meter's readings are a contiguous slice.
+    """
+
+    def __init__(self, root=columnar_root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._dictionary_path = os.path.join(self.root, 'meters.txt')
+        self._dictionary_lock = ProcessLock(os.path.join(self.root, 'meters.lock'))
+        self._dictionary_size = 0 # bytes of meters.txt read so far
+        self.meter_ids = [] # code -> meter Id
+        self.meter_codes = {} # meter Id -> code
+        self._catch_up()
+
+    def _remember(self, meter_id):
+        self.meter_codes[meter_id] = len(self.meter_ids)
+        self.meter_ids.append(meter_id)
+
+    def _catch_up(self):
+        """Read the meter Ids appended to meters.txt since the last call, whole lines only"""
+        if not os.path.exists(self._dictionary_path):
+            return
+        with open(self._dictionary_path, 'rb') as file:
+            file.seek(self._dictionary_size)
+            data = file.read()
+        complete = data.rfind(b'\n') + 1
+        for meter_id in data[:complete].decode().splitlines():
+            self._remember(meter_id)
+        self._dictionary_size += complete
+
+    def encode(self, meter_ids):
+        """Dictionary-encode meter Ids, adding unseen ones to meters.txt; returns a uint32 array"""
+        with self._lock:
+            new_ids = [meter_id for meter_id in dict.fromkeys(meter_ids) if meter_id not in self.meter_codes]
+            if new_ids:
+                self._dictionary_lock.acquire(blocking=True)
+                try:
+                    # Another process may have added codes, some of them for these meters
+                    self._catch_up()
+                    new_ids = [meter_id for meter_id in new_ids if meter_id not in self.meter_codes]
+                    with open(self._dictionary_path, 'ab') as file:
+                        file.write("".join(meter_id + "\n" for meter_id in new_ids).encode())
+                        file.flush()
+                        os.fsync(file.fileno())
+                        self._dictionary_size = file.tell()
+                finally:
+                    self._dictionary_lock.release()
+                for meter_id in new_ids:
+                    self._remember(meter_id)
+            return np.fromiter((self.meter_codes[meter_id] for meter_id in meter_ids), dtype=np.uint32, count=len(meter_ids))
+
+    def partition_path(self, date, root=None):
+        return os.path.join(root or self.root, f"{date}.bin")
+
+    def partitions(self):
+        """Dates (YYYY-MM-DD) that have a partition, oldest first"""
+        return sorted(name[:-4] for name in os.listdir(self.root) if name.endswith('.bin'))
+
+    def load_partition(self, date, root=None):
+        """Memory-map one day's columns as (meter codes, timestamps, readings); empty arrays if absent"""
+        path = self.partition_path(date, root)
+        if not os.path.exists(path):
+            return np.empty(0, np.uint32), np.empty(0, np.int64), np.empty(0, np.float64)
+
+        with open(path, 'rb') as file:
+            magic, version, count = partition_header.unpack(file.read(partition_header.size))
+        if magic != partition_magic or version != 1:
+            raise ValueError(f"Not a reading partition: {path}")
+        if count == 0:
+            return np.empty(0, np.uint32), np.empty(0, np.int64), np.empty(0, np.float64)
+
+        codes_offset = partition_header.size
+        timestamps_offset = codes_offset + _padded(count * 4)
+        readings_offset = timestamps_offset + count * 8
+        return (
+            np.memmap(path, dtype=np.uint32, mode='r', offset=codes_offset, shape=(count,)),
+            np.memmap(path, dtype=np.int64, mode='r', offset=timestamps_offset, shape=(count,)),
+            np.memmap(path, dtype=np.float64, mode='r', offset=readings_offset, shape=(count,)),
+        )
+
+    def meter_range(self, meter_id, start_date=None, end_date=None):
+        """(timestamps, readings) of one meter from start_date to end_date inclusive, by binary search in each partition"""
+        code = self.meter_codes.get(meter_id)
+        if code is None:
+            with self._lock:
+                self._catch_up() # it may have been added by another process
+            code = self.meter_codes.get(meter_id)
+        if code is None:
+            return np.empty(0, np.int64), np.empty(0, np.float64)
+
+        dates = self.partitions()
+        low = bisect_left(dates, start_date) if start_date else 0
+        high = bisect_right(dates, end_date) if end_date else len(dates)
+
+        timestamps, readings = [], []
+        for date in dates[low:high]:
+            codes, partition_timestamps, partition_readings = self.load_partition(date)
+            # Rows are sorted by meter code, so the meter's readings are one contiguous slice
+            first = np.searchsorted(codes, code, side='left')
+            last = np.searchsorted(codes, code, side='right')
+            timestamps.append(partition_timestamps[first:last])
+            readings.append(partition_readings[first:last])
+
+        if not timestamps:
+            return np.empty(0, np.int64), np.empty(0, np.float64)
+        return np.concatenate(timestamps), np.concatenate(readings)
+
+    def write_partition(self, date, meter_codes, timestamps, readings, root=None):
+        """Replace one day's partition with the given columns, sorted by (meter, timestamp), atomically.
+
+        A meter keeps one reading per timestamp, the later one in the input, so archiving
+        the same readings twice changes nothing.
+        """
+        order = np.lexsort((timestamps, meter_codes)) # stable, so ties keep their input order
+        meter_codes = np.asarray(meter_codes, dtype=np.uint32)[order]
+        timestamps = np.asarray(timestamps, dtype=np.int64)[order]
+        readings = np.asarray(readings, dtype=np.float64)[order]
+
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = (meter_codes[1:] != meter_codes[:-1]) | (timestamps[1:] != timestamps[:-1])
+        if not last.all():
+            meter_codes, timestamps, readings = meter_codes[last], timestamps[last], readings[last]
+
+        count = len(timestamps)
+        path = self.partition_path(date, root)
+        tmp_file = path + ".tmp"
+        with open(tmp_file, 'wb') as file:
+            file.write(partition_header.pack(partition_magic, 1, count))
+            file.write(meter_codes.tobytes())
+            file.write(b'\0' * (_padded(count * 4) - count * 4))
+            file.write(timestamps.tobytes())
+            file.write(readings.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_file, path)
+
+    def append(self, meter_codes, timestamps, readings, root=None):
+        """Merge rows into their day partitions, under root if given; returns the dates touched"""
+        meter_codes = np.asarray(meter_codes, dtype=np.uint32)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        readings = np.asarray(readings, dtype=np.float64)
+        days = timestamps // 86400
+
+        touched = []
+        for day in np.unique(days):
+            mask = days == day
+            date = str(np.datetime64(int(day), 'D'))
+            old_codes, old_timestamps, old_readings = self.load_partition(date, root)
+            self.write_partition(
+                date,
+                np.concatenate([old_codes, meter_codes[mask]]),
+                np.concatenate([old_timestamps, timestamps[mask]]),
+                np.concatenate([old_readings, readings[mask]]),
+                root,
+            )
+            touched.append(date)
+        return touched
+
+    def append_buffers(self, meter_readings):
+        """Archive a meter Id -> MeterReadingBuffer mapping, e.g. the nightly snapshot"""
+        meter_ids = [meter_id for meter_id, buffer in meter_readings.items() if buffer]
+        if not meter_ids:
+            return []
+        buffers = [meter_readings[meter_id] for meter_id in meter_ids]
+        codes = np.repeat(self.encode(meter_ids), [len(buffer) for buffer in buffers])
+        timestamps = np.concatenate([np.frombuffer(buffer.timestamps, dtype=np.int64) for buffer in buffers])
+        readings = np.concatenate([np.frombuffer(buffer.readings, dtype=np.float64) for buffer in buffers])
+        return self.append(codes, timestamps, readings)
+
+    def import_csv(self, csv_path, chunk_rows=1_000_000):
+        """One-off migration of a half-hourly CSV into partitions, in bounded-memory chunks; returns the readings imported.
+
+        Days that already have a partition, i.e. were archived by a batch job or an earlier
+        import, are skipped. The other days are built under import/ and each replaces its
+        partition once the whole CSV is read, so an interrupted import can simply be re-run.
+        """
+        staging = os.path.join(self.root, 'import')
+        if os.path.isdir(staging):
+            shutil.rmtree(staging) # left by an interrupted run
+        os.makedirs(staging)
+        archived_days = np.array(self.partitions(), dtype='datetime64[D]').astype(np.int64)
+
+        imported = 0
+        with open(csv_path, 'r', newline='') as file:
+            reader = csv.reader(file)
+            next(reader, None)  # skip header
+            while True:
+                meter_ids, timestamps, readings = [], [], []
+                for row in reader:
+                    if not row:
+                        continue
+                    meter_ids.append(row[0])
+                    timestamps.append(MeterReadingBuffer.to_timestamp(row[1], row[2]))
+                    readings.append(float(row[3]))
+                    if len(meter_ids) >= chunk_rows:
+                        break
+                if not meter_ids:
+                    break
+                timestamps = np.array(timestamps, dtype=np.int64)
+                new = ~np.isin(timestamps // 86400, archived_days)
+                codes = self.encode([meter_id for meter_id, keep in zip(meter_ids, new.tolist()) if keep])
+                self.append(codes, timestamps[new], np.array(readings, dtype=np.float64)[new], staging)
+                imported += len(codes)
+
+        for name in sorted(os.listdir(staging)):
+            os.replace(os.path.join(staging, name), os.path.join(self.root, name))
+        os.rmdir(staging)
+        return imported
+
+
+def _padded(size):
+    return (size + 7) // 8 * 8
+
+
+if __name__ == "__main__":
+    # python columnar_store.py: build partitions from the existing half-hourly CSV
+    from utils import half_hourly_readings_csv_filepath
+    print(f"Imported {ColumnarReadingStore().import_csv(half_hourly_readings_csv_filepath)} reading(s).")
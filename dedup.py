@@ -0,0 +1,104 @@
+import os
+import math
+import struct
+from hashlib import blake2b
+
+from metrics import dedup_checks_total, dedup_duplicates_total
+
+
+# Readings per Bloom filter generation, and its false positive rate once full. Two generations are
+# kept, each about 1.8 MB per million readings at 0.1%
+dedup_capacity = int(os.environ.get("METER_DEDUP_CAPACITY", 4000000))
+dedup_error_rate = float(os.environ.get("METER_DEDUP_ERROR_RATE", 0.001))
+
+
+class BloomFilter:
+    """Fixed-size set of byte strings: no false negatives, about error_rate false positives at capacity"""
+    __slots__ = ("size", "hashes", "bits", "count", "_unpack")
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 64)
+        # One 32-bit slice of a blake2b digest per hash, and a digest is at most 64 bytes
+        self.hashes = min(max(round(self.size / capacity * math.log(2)), 1), 16)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self._unpack = struct.Struct(f"<{self.hashes}I").unpack
+
+    def positions(self, key):
+        """Bit positions of a key, from one digest"""
+        size = self.size
+        return [value % size for value in self._unpack(blake2b(key, digest_size=4 * self.hashes).digest())]
+
+    def has(self, positions):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in positions)
+
+    def add(self, positions):
+        bits = self.bits
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return self.has(self.positions(key))
+
+
+class ReadingDedupIndex:
+    """Readings already stored, by (meter Id, timestamp, value), to drop retried posts in O(1) and bounded memory.
+
+    A reading with a known meter and timestamp but another value is a correction, and gets
+    through. The latest reading of every meter is exact: it catches the usual retry of the last
+    reading and lets every newer reading through without hashing. Older readings are looked up
+    in two generations of Bloom filters, so a genuine late reading is dropped with about
+    error_rate probability. Once a generation holds `capacity` readings it becomes the previous
+    one, and readings older than that are forgotten. check() only looks; record() a reading once
+    it is queued, so one that failed to queue is not dropped as a duplicate when retried.
+    Not thread-safe; app.py calls it under readings_lock.
+    """
+
+    def __init__(self, capacity=dedup_capacity, error_rate=dedup_error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.latest = {} # meter Id -> (timestamp, value) of its latest reading stored
+        self.current = BloomFilter(capacity, error_rate)
+        self.previous = None
+
+    def check(self, meter_id, timestamp, reading):
+        """None if a reading is new, or the index that caught it as stored already ("latest" or "filter")"""
+        dedup_checks_total.inc()
+        latest = self.latest.get(meter_id)
+        # A meter's filter entries are never newer than its latest reading, so only older ones are looked up
+        if latest is None or timestamp > latest[0]:
+            return None
+        if latest == (timestamp, reading):
+            dedup_duplicates_total.inc(index="latest")
+            return "latest"
+
+        positions = self.current.positions(_key(meter_id, timestamp, reading))
+        if self.current.has(positions) or (self.previous is not None and self.previous.has(positions)):
+            dedup_duplicates_total.inc(index="filter")
+            return "filter"
+        return None
+
+    def record(self, meter_id, timestamp, reading):
+        """Remember a reading that was stored"""
+        latest = self.latest.get(meter_id)
+        if latest is None or timestamp >= latest[0]:
+            self.latest[meter_id] = (timestamp, reading)
+        self._add(self.current.positions(_key(meter_id, timestamp, reading)))
+
+    def seed(self, meter_readings):
+        """Record readings already held, e.g. today's buffers recovered at startup"""
+        for meter_id, buffer in meter_readings.items():
+            for timestamp, reading in zip(buffer.timestamps, buffer.readings):
+                self.record(meter_id, timestamp, reading)
+
+    def _add(self, positions):
+        if self.current.count >= self.capacity:
+            # Both generations have the same size and hash count, so positions carry over
+            self.previous, self.current = self.current, BloomFilter(self.capacity, self.error_rate)
+        self.current.add(positions)
+
+
+def _key(meter_id, timestamp, reading):
+    return f"{meter_id}|{timestamp}|{reading!r}".encode()
@@ -0,0 +1,115 @@
+import threading
+from bisect import bisect_left
+
+
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Every metric created, in creation order, for /metrics
+registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(labelnames, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {} # label values tuple -> value
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=default_buckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts (not yet cumulative), sum, count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            position = bisect_left(self.buckets, value)
+            if position < len(self.buckets):
+                state[0][position] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Metrics shared by app.py, utils.py and dedup.py
+http_requests_total = Counter("meter_http_requests_total", "HTTP requests handled.", ("route", "method", "status"))
+http_request_duration_seconds = Histogram("meter_http_request_duration_seconds", "HTTP request latency.", ("route", "method"))
+csv_append_duration_seconds = Histogram("meter_csv_append_duration_seconds", "Latency of one group append to the half-hourly CSV.")
+csv_append_bytes_total = Counter("meter_csv_append_bytes_total", "Bytes appended to the half-hourly CSV.")
+csv_append_rows_total = Counter("meter_csv_append_rows_total", "Rows appended to the half-hourly CSV.")
+readings_in_memory = Gauge("meter_readings_in_memory", "Readings held in today's in-memory buffer.")
+readings_in_memory_bytes = Gauge("meter_readings_in_memory_bytes", "Bytes of timestamps and readings in today's in-memory buffer.")
+meters_in_memory = Gauge("meter_readings_meters_in_memory", "Meters with readings in today's in-memory buffer.")
+batch_phase_duration_seconds = Gauge("meter_batch_phase_duration_seconds", "Duration of each phase of the last batch job.", ("phase",))
+batch_runs_total = Counter("meter_batch_runs_total", "Batch jobs run, by outcome.", ("state",))
+dedup_checks_total = Counter("meter_dedup_checks_total", "Readings checked against the duplicate index at ingest.")
+dedup_duplicates_total = Counter("meter_dedup_duplicates_total", "Duplicate readings dropped at ingest, by the index that caught them.", ("index",))
@@ -1,4 +1,6 @@
 class ElectricityAccount:
+    __slots__ = ("meter_id", "area", "region", "dwelling_type")
+
     def __init__(self, meter_id, area, region, dwelling_type):
         self.meter_id = meter_id
         self.area = area
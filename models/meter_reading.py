@@ -1,6 +1,8 @@
-from datetime import datetime
+from validation import validate_reading, error_messages
 
 class MeterReading:
+    __slots__ = ("meter_id", "date", "time", "electricity_reading")
+
     def __init__(self, meter_id, date, time, electricity_reading):
         self.meter_id = meter_id
         self.date = date # yyyy/mm/dd
@@ -37,32 +39,7 @@ class MeterReading:
     @classmethod
     def validate_and_create(cls, meter_id, date, time, electricity_reading):
         """Validate and create a new MeterReading instance"""
-        try:
-            # Basic validation
-            if not all([meter_id, date, time, electricity_reading]):
-                raise ValueError("All fields are required")
-
-            # Validate date format
-            try:
-                datetime.strptime(date, '%Y-%m-%d')
-            except:
-                raise ValueError('Invalid date format. Use YYYY-MM-DD')
-
-            # Validate time format
-            try:
-                datetime.strptime(time, '%H:%M')
-            except:
-                raise ValueError('Invalid time format. Use HH:MM')
-
-            # Validate electricity reading
-            electricity_reading = float(electricity_reading)
-            if electricity_reading < 0:
-                raise ValueError("Electricity reading must be positive")
-
-            # Create instance if all validations pass
-            reading = cls(meter_id, date, time, electricity_reading)
-
-            return reading
-
-        except ValueError as e:
-            raise ValueError(f"Validation failed: {str(e)}")
\ No newline at end of file
+        error, _, electricity_reading = validate_reading(meter_id, date, time, electricity_reading)
+        if error:
+            raise ValueError(f"Validation failed: {error_messages[error]}")
+        return cls(meter_id, date, time, electricity_reading)
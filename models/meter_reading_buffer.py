@@ -0,0 +1,50 @@
+from array import array
+from datetime import datetime, timezone
+
+from validation import date_seconds, time_seconds
+
+
+class MeterReadingBuffer:
+    """Compact intraday readings of one meter: epoch-second timestamps and cumulative kWh in typed arrays"""
+    __slots__ = ("timestamps", "readings")
+
+    def __init__(self):
+        self.timestamps = array('q') # seconds since epoch, date and time read as UTC
+        self.readings = array('d') # cumulative kWh
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def copy(self):
+        """Independent copy of the buffer"""
+        buffer = MeterReadingBuffer()
+        buffer.timestamps = array('q', self.timestamps)
+        buffer.readings = array('d', self.readings)
+        return buffer
+
+    def append(self, timestamp, electricity_reading):
+        self.timestamps.append(timestamp)
+        self.readings.append(electricity_reading)
+
+    def extend(self, other):
+        """Append another buffer's readings after this one's"""
+        self.timestamps.extend(other.timestamps)
+        self.readings.extend(other.readings)
+
+    @staticmethod
+    def to_timestamp(date, time):
+        """Convert a YYYY-MM-DD date and HH:MM time to epoch seconds; ValueError if either is invalid"""
+        day, minute = date_seconds(date), time_seconds(time)
+        if day is None or minute is None:
+            raise ValueError(f"Invalid date or time: {date} {time}")
+        return day + minute
+
+    @staticmethod
+    def from_timestamp(timestamp):
+        """Convert epoch seconds back to (YYYY-MM-DD, HH:MM)"""
+        moment = datetime.fromtimestamp(timestamp, timezone.utc)
+        return moment.strftime("%Y-%m-%d"), moment.strftime("%H:%M")
+
+    def curve(self):
+        """Readings ordered by timestamp, as (timestamp, cumulative kWh) pairs; a later reading for a timestamp corrects the earlier one"""
+        return sorted(dict(zip(self.timestamps, self.readings)).items())
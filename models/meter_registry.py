@@ -0,0 +1,50 @@
+class MeterRegistry:
+    def __init__(self, accounts=(), fallback=None):
+        self._accounts = {} # meter_id -> ElectricityAccount, in registration order
+        self._by_region = {} # region -> {meter_id: ElectricityAccount}
+        self._by_area = {} # area -> {meter_id: ElectricityAccount}
+        self._by_dwelling_type = {} # dwelling_type -> {meter_id: ElectricityAccount}
+        self._fallback = fallback # meter_id -> ElectricityAccount or None, for meters registered by another process
+        for account in accounts:
+            self.add(account)
+
+    def __contains__(self, meter_id):
+        return isinstance(meter_id, str) and self.get(meter_id) is not None
+
+    def __iter__(self):
+        return iter(self._accounts.values())
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def get(self, meter_id):
+        """Look up the ElectricityAccount for a meter Id, or None"""
+        account = self._accounts.get(meter_id)
+        if account is None and self._fallback is not None:
+            account = self._fallback(meter_id)
+            if account is not None:
+                self.add(account)
+        return account
+
+    def add(self, account):
+        """Register an ElectricityAccount; return False if the meter Id is already taken"""
+        if account.meter_id in self._accounts:
+            return False
+
+        self._accounts[account.meter_id] = account
+        self._by_region.setdefault(account.region, {})[account.meter_id] = account
+        self._by_area.setdefault(account.area, {})[account.meter_id] = account
+        self._by_dwelling_type.setdefault(account.dwelling_type, {})[account.meter_id] = account
+        return True
+
+    def by_region(self, region):
+        """All accounts in a region"""
+        return list(self._by_region.get(region, {}).values())
+
+    def by_area(self, area):
+        """All accounts in an area"""
+        return list(self._by_area.get(area, {}).values())
+
+    def by_dwelling_type(self, dwelling_type):
+        """All accounts of a dwelling type"""
+        return list(self._by_dwelling_type.get(dwelling_type, {}).values())
@@ -0,0 +1,42 @@
+import threading
+
+try:
+    import fcntl
+except ImportError: # Windows: the lock only covers this process
+    fcntl = None
+
+
+class ProcessLock:
+    """Lock held across the processes on a host that use the same path, and the threads of each.
+
+    Backed by flock(), which the kernel drops if the holder dies, so a crashed batch never leaves
+    it taken. Unlike a threading.Lock, it may be released by another thread than the one that took it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def acquire(self, blocking=False):
+        """Take the lock, waiting for it if blocking, else only if it is free; returns whether it was taken"""
+        if not self._lock.acquire(blocking=blocking):
+            return False
+        if fcntl is None:
+            return True
+
+        file = open(self.path, 'a')
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            self._lock.release()
+            return False
+        self._file = file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            self._file.close() # closing the file drops the flock
+            self._file = None
+        self._lock.release()
@@ -0,0 +1,43 @@
+import os
+import sys
+import pickle
+
+
+# Process pool for the batch job. The server is multithreaded, so workers are fresh interpreters
+# rather than forks, which could inherit a lock held by another thread. multiprocessing's spawn and
+# forkserver would re-run the server's __main__ in them, so each worker is a plain subprocess that
+# only imports this module, reading its pickled task and input from stdin.
+pool_worker_command = [sys.executable, "-c", "import process_pool; process_pool.serve_pool_task()"]
+
+
+def serve_pool_task():
+    """Pool worker: run the pickled (task, input) on stdin, pickle (result, exception) to stdout"""
+    task, value = pickle.load(sys.stdin.buffer)
+    try:
+        outcome = (task(value), None)
+    except Exception as e:
+        outcome = (None, e)
+    pickle.dump(outcome, sys.stdout.buffer, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def run_in_process_pool(task, inputs):
+    """[task(input) for input in inputs], one worker process per input; results in input order"""
+    if len(inputs) <= 1:
+        return [task(value) for value in inputs]
+
+    import subprocess # not needed by workers that never run the batch job
+    from concurrent.futures import ThreadPoolExecutor
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), env.get("PYTHONPATH")]))
+
+    def run_worker(value):
+        worker = subprocess.run(pool_worker_command, input=pickle.dumps((task, value), protocol=pickle.HIGHEST_PROTOCOL),
+                                stdout=subprocess.PIPE, env=env, check=True)
+        result, error = pickle.loads(worker.stdout)
+        if error is not None:
+            raise error
+        return result
+
+    with ThreadPoolExecutor(len(inputs)) as pool:
+        return list(pool.map(run_worker, inputs))
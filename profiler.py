@@ -0,0 +1,175 @@
+import os
+import sys
+import io
+import cProfile
+import marshal
+import pstats
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from itertools import count
+
+
+modes = ("sample", "cprofile") # sample: stack sampling, collapsed stacks; cprofile: deterministic, pstats
+jobs = ("batch", "calculate_daily_usage", "calculate_monthly_usage") # batch targets besides routes
+any_route = "*"
+
+sample_interval_s = 0.005
+profile_keep = 20 # finished profiles kept for retrieval, oldest dropped first
+max_pstats_lines = 60
+
+profiles = deque(maxlen=profile_keep)
+armed = {} # route template, job name or any_route -> [mode, remaining count]
+_ids = count(1)
+_cprofile_threads = set() # threads with a cProfile hook installed
+_lock = threading.Lock()
+
+
+def arm(target, requests=1, mode="sample"):
+    """Profile the next `requests` runs of a route template, a job, or any route"""
+    with _lock:
+        armed[target] = [mode, requests]
+
+
+def disarm():
+    with _lock:
+        armed.clear()
+
+
+def claim(target, fallback=None):
+    """Take one armed run for target (or fallback); returns the mode or None"""
+    if not armed: # cheap check on every request while nothing is armed
+        return None
+    with _lock:
+        for key in (target, fallback):
+            entry = armed.get(key)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del armed[key]
+                return entry[0]
+    return None
+
+
+def _frame_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+
+
+class StackSampler(threading.Thread):
+    """Sample one thread's Python stack every interval from a side thread; the profiled thread pays nothing"""
+
+    def __init__(self, thread_id, interval=sample_interval_s):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter() # collapsed stack, root first -> samples
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if labels:
+                self.stacks[";".join(reversed(labels))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class ProfileSession:
+    """One running profile of the calling thread; stop() stores the result in `profiles`"""
+
+    def __init__(self, name, mode):
+        self.name = name
+        self.mode = mode
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._thread_id = threading.get_ident()
+        if mode == "cprofile":
+            # A thread has one profile hook, and Python 3.12+ one cProfile overall; sample when it is taken
+            self._profiler = cProfile.Profile()
+            try:
+                if self._thread_id in _cprofile_threads:
+                    raise ValueError
+                self._profiler.enable()
+                _cprofile_threads.add(self._thread_id)
+            except ValueError:
+                self.mode = "sample"
+        if self.mode == "sample":
+            self._profiler = StackSampler(self._thread_id)
+            self._profiler.start()
+
+    def stop(self):
+        duration = time.perf_counter() - self._started
+        if self.mode == "cprofile":
+            self._profiler.disable()
+            _cprofile_threads.discard(self._thread_id)
+            data = pstats.Stats(self._profiler)
+            samples = data.total_calls
+        else:
+            self._profiler.stop()
+            data = self._profiler.stacks
+            samples = sum(data.values())
+
+        profile = {
+            "id": next(_ids),
+            "name": self.name,
+            "mode": self.mode,
+            "started_at": self.started_at,
+            "duration_s": duration,
+            "samples": samples, # stack samples, or function calls for cprofile
+        }
+        with _lock:
+            profiles.append((profile, data))
+        return profile
+
+
+@contextmanager
+def profile_job(name):
+    """Profile a batch job, if it has been armed"""
+    mode = claim(name)
+    session = ProfileSession(name, mode) if mode else None
+    try:
+        yield
+    finally:
+        if session:
+            session.stop()
+
+
+def list_profiles():
+    """Metadata of the kept profiles, newest first"""
+    with _lock:
+        return [profile for profile, _ in reversed(profiles)]
+
+
+def render_profile(profile_id, output_format=None):
+    """A kept profile as (body, mimetype); None if it is gone, ValueError for a format its mode can't produce.
+
+    sample profiles render as collapsed stacks ("collapsed", for flamegraph.pl / speedscope);
+    cprofile ones as a pstats report ("pstats") or the marshalled stats pstats.Stats() loads ("raw").
+    """
+    with _lock:
+        found = next(((profile, data) for profile, data in profiles if profile["id"] == profile_id), None)
+    if found is None:
+        return None
+    profile, data = found
+
+    if profile["mode"] == "sample":
+        if output_format not in (None, "collapsed"):
+            raise ValueError("Sampled profiles are available as 'collapsed' only.")
+        return "".join(f"{stack} {samples}\n" for stack, samples in data.most_common()), "text/plain"
+
+    if output_format == "raw":
+        return marshal.dumps(data.stats), "application/octet-stream"
+    if output_format not in (None, "pstats"):
+        raise ValueError("cProfile profiles are available as 'pstats' or 'raw'.")
+    stream = io.StringIO()
+    report = pstats.Stats(stream=stream)
+    report.add(data)
+    report.sort_stats("cumulative").print_stats(max_pstats_lines)
+    return stream.getvalue(), "text/plain"
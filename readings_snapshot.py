@@ -0,0 +1,132 @@
+import os
+import csv
+import mmap
+import struct
+from collections import defaultdict
+
+from models.meter_reading_buffer import MeterReadingBuffer
+from utils import (half_hourly_readings_csv_filepath, daily_file, monthly_file, shared_storage, rollback_usage_files,
+                   logger)
+
+
+# Crash recovery: a binary snapshot of today's readings plus the CSV offset it covers
+readings_snapshot_path = 'archived_data/readings_snapshot.bin'
+readings_snapshot_interval_s = 60
+readings_snapshot_header = struct.Struct('<4sHqI') # magic, version, CSV byte offset, meter count
+readings_snapshot_meter = struct.Struct('<HI') # meter Id length, reading count
+readings_snapshot_usage = struct.Struct('<qQQ') # usage file size (-1 if missing), device, inode; daily then monthly
+
+
+# Snapshot today's readings for crash recovery
+def save_readings_snapshot(meter_readings, csv_offset, usage_state):
+    """Write the reading buffers, the half-hourly CSV offset they cover and the committed usage_file_state() to a binary snapshot, atomically"""
+    buffers = [(meter_id, buffer) for meter_id, buffer in meter_readings.items() if buffer]
+
+    tmp_file = readings_snapshot_path + ".tmp"
+    with open(tmp_file, 'wb') as file:
+        file.write(readings_snapshot_header.pack(b'MRSN', 2, csv_offset, len(buffers)))
+        for usage_file in (daily_file, monthly_file):
+            file.write(readings_snapshot_usage.pack(*(usage_state[usage_file] or (-1, 0, 0))))
+        for meter_id, buffer in buffers:
+            encoded_id = meter_id.encode()
+            file.write(readings_snapshot_meter.pack(len(encoded_id), len(buffer)))
+            file.write(encoded_id)
+            file.write(buffer.timestamps.tobytes())
+            file.write(buffer.readings.tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_file, readings_snapshot_path)
+
+
+def load_readings_snapshot():
+    """Load (meter_readings, CSV offset, usage file state or None) from the binary snapshot, or None if there is no usable snapshot"""
+    if not os.path.exists(readings_snapshot_path):
+        return None
+
+    with open(readings_snapshot_path, 'rb') as file:
+        data = memoryview(file.read())
+
+    try:
+        magic, version, csv_offset, meter_count = readings_snapshot_header.unpack_from(data, 0)
+        if magic != b'MRSN' or version not in (1, 2):
+            return None
+
+        position = readings_snapshot_header.size
+        usage_state = None
+        if version >= 2:
+            usage_state = {}
+            for usage_file in (daily_file, monthly_file):
+                size, device, inode = readings_snapshot_usage.unpack_from(data, position)
+                position += readings_snapshot_usage.size
+                usage_state[usage_file] = None if size < 0 else (size, device, inode)
+
+        meter_readings = defaultdict(MeterReadingBuffer)
+        for _ in range(meter_count):
+            id_length, count = readings_snapshot_meter.unpack_from(data, position)
+            position += readings_snapshot_meter.size
+            meter_id = bytes(data[position:position + id_length]).decode()
+            position += id_length
+
+            buffer = meter_readings[meter_id]
+            buffer.timestamps.frombytes(data[position:position + count * 8])
+            position += count * 8
+            buffer.readings.frombytes(data[position:position + count * 8])
+            position += count * 8
+    except (struct.error, ValueError) as e:
+        logger.warning("Ignoring unreadable readings snapshot: %s", e)
+        return None
+    return meter_readings, csv_offset, usage_state
+
+
+def replay_half_hourly_csv(meter_readings, csv_offset):
+    """Fold the half-hourly CSV rows past csv_offset into meter_readings; return the number replayed"""
+    if not os.path.exists(half_hourly_readings_csv_filepath):
+        return 0
+
+    with open(half_hourly_readings_csv_filepath, 'rb+') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size <= csv_offset:
+            return 0
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            tail = mapped[csv_offset:size]
+
+        # Drop a torn last row from a crash mid-append so the next append starts on a fresh line
+        complete = tail.rfind(b'\n') + 1
+        if complete < len(tail):
+            file.truncate(csv_offset + complete)
+
+    replayed = 0
+    for row in csv.reader(tail[:complete].decode().splitlines()):
+        try:
+            meter_id, date, time_, electricity_reading = row
+            timestamp = MeterReadingBuffer.to_timestamp(date, time_)
+            electricity_reading = float(electricity_reading)
+        except ValueError:
+            continue  # header or malformed row
+        meter_readings[meter_id].append(timestamp, electricity_reading)
+        replayed += 1
+    return replayed
+
+
+def recover_meter_readings():
+    """Rebuild today's reading buffers from the last snapshot plus the half-hourly CSV written after it.
+
+    A batch job that died before its checkpoint left usage rows for readings that are recovered
+    here, so the usage files are rolled back to the state the snapshot recorded.
+    """
+    if shared_storage():
+        # Today's readings stay in the database until the batch job claims them
+        return defaultdict(MeterReadingBuffer), 0
+
+    snapshot = load_readings_snapshot()
+    if snapshot is None:
+        # Nothing to recover from, start the day empty at the current end of the CSV
+        csv_offset = os.path.getsize(half_hourly_readings_csv_filepath) if os.path.exists(half_hourly_readings_csv_filepath) else 0
+        return defaultdict(MeterReadingBuffer), csv_offset
+
+    meter_readings, csv_offset, usage_state = snapshot
+    if usage_state is not None:
+        rollback_usage_files(usage_state)
+    replayed = replay_half_hourly_csv(meter_readings, csv_offset)
+    logger.info("Recovered %d reading(s), %d replayed from the CSV.", sum(len(buffer) for buffer in meter_readings.values()), replayed)
+    return meter_readings, csv_offset
@@ -0,0 +1,52 @@
+import threading
+from datetime import datetime
+
+
+# Dimensions the usage rollups can be grouped by
+rollup_dimensions = ("region", "area", "dwelling_type")
+
+
+class UsageRollupCube:
+    """Total and count of usage per day and per month, for every combination of region/area/dwelling_type"""
+
+    def __init__(self):
+        # granularity -> dimension mask -> (period, region, area, dwelling_type) -> [total, count];
+        # dimensions left out of the mask are None, so each mask is one precomputed group-by
+        self._cells = {"day": {}, "month": {}}
+        for cuboids in self._cells.values():
+            for mask in range(1 << len(rollup_dimensions)):
+                cuboids[mask] = {}
+        self._lock = threading.Lock()
+
+    def add(self, granularity, period, region, area, dwelling_type, usage, count=1):
+        """Fold one usage value into every cuboid"""
+        values = (region, area, dwelling_type)
+        with self._lock:
+            for mask, cells in self._cells[granularity].items():
+                key = (period,) + tuple(value if mask >> i & 1 else None for i, value in enumerate(values))
+                cell = cells.get(key)
+                if cell is None:
+                    cells[key] = [usage, count]
+                else:
+                    cell[0] += usage
+                    cell[1] += count
+
+    def query(self, granularity, group_by):
+        """Total, count and mean per period and per group_by dimensions, oldest period first"""
+        mask = sum(1 << rollup_dimensions.index(dimension) for dimension in group_by)
+        with self._lock:
+            cells = list(self._cells[granularity][mask].items())
+
+        period_key = (lambda period: datetime.strptime(period, "%Y-%b")) if granularity == "month" else (lambda period: period)
+        # A period's groups in dimension order, not in the order their rows happened to be read
+        cells.sort(key=lambda item: (period_key(item[0][0]), [value or "" for value in item[0][1:]]))
+
+        results = []
+        for key, (total, count) in cells:
+            result = {"period": key[0]}
+            for i, dimension in enumerate(rollup_dimensions):
+                if mask >> i & 1:
+                    result[dimension] = key[i + 1]
+            result.update(total=total, count=count, mean=total / count if count else None)
+            results.append(result)
+        return results
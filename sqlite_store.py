@@ -0,0 +1,248 @@
+import os
+import csv
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from models.electricity_account import ElectricityAccount
+from models.meter_reading_buffer import MeterReadingBuffer
+
+
+sqlite_path = os.path.join('archived_data', 'meters.db')
+
+schema = """
+CREATE TABLE IF NOT EXISTS accounts (
+    meter_id TEXT PRIMARY KEY,
+    area TEXT NOT NULL,
+    region TEXT NOT NULL,
+    dwelling_type TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS accounts_region ON accounts (region);
+CREATE INDEX IF NOT EXISTS accounts_area ON accounts (area);
+CREATE INDEX IF NOT EXISTS accounts_dwelling_type ON accounts (dwelling_type);
+
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER PRIMARY KEY,
+    meter_id TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    reading REAL NOT NULL
+);
+-- Index entries end with the rowid, so this also serves "meter_id = ? AND id > ?"
+CREATE INDEX IF NOT EXISTS readings_meter ON readings (meter_id);
+-- Finds a retried reading, whichever worker received it first
+CREATE INDEX IF NOT EXISTS readings_meter_timestamp ON readings (meter_id, timestamp);
+
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# Statements are constant strings, so each connection prepares them once and reuses them from its statement cache
+select_accounts = "SELECT meter_id, area, region, dwelling_type FROM accounts ORDER BY rowid"
+select_account = "SELECT meter_id, area, region, dwelling_type FROM accounts WHERE meter_id = ?"
+insert_account = "INSERT INTO accounts (meter_id, area, region, dwelling_type) VALUES (?, ?, ?, ?) ON CONFLICT (meter_id) DO NOTHING"
+insert_reading = ("INSERT INTO readings (meter_id, timestamp, reading) SELECT ?1, ?2, ?3 "
+                  "WHERE NOT EXISTS (SELECT 1 FROM readings WHERE meter_id = ?1 AND timestamp = ?2 AND reading = ?3)")
+select_cutoff = "SELECT value FROM state WHERE key = 'batch_cutoff'"
+update_cutoff = "INSERT INTO state (key, value) VALUES ('batch_cutoff', ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+update_state = "INSERT INTO state (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+select_usage_state = "SELECT key, value FROM state WHERE key LIKE 'usage:%'"
+select_pending = "SELECT meter_id, timestamp, reading FROM readings WHERE id > ? AND id <= ? ORDER BY id"
+select_range = "SELECT meter_id, timestamp, reading FROM readings WHERE timestamp >= ? AND timestamp < ? ORDER BY id"
+select_pending_for_meter = "SELECT timestamp, reading FROM readings WHERE meter_id = ? AND id > ? ORDER BY id"
+
+
+class SQLiteStorage:
+    """Accounts and half-hourly readings in one SQLite database in WAL mode, shared by every worker process.
+
+    Readings with an id above the batch cutoff are the ones the next batch job processes; the
+    job moves the cutoff once it has written their usage, whichever worker it runs in, and
+    records alongside it the usage files it committed, so the next job can roll back one that died.
+    """
+
+    def __init__(self, path=sqlite_path, synchronous="FULL", busy_timeout_ms=10000):
+        self.path = path
+        self.synchronous = synchronous
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local() # sqlite3 connections can't be shared between threads
+        self._connection().executescript(schema)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit mode, transactions are begun explicitly
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute(f"PRAGMA synchronous = {self.synchronous}")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, or ROLLBACK on error.
+
+        IMMEDIATE takes the write lock up front, so concurrent writers queue on busy_timeout
+        instead of failing to upgrade a read transaction.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def load_accounts(self):
+        """All accounts, in registration order"""
+        return [ElectricityAccount(*row) for row in self._connection().execute(select_accounts)]
+
+    def get_account(self, meter_id):
+        """Look up one account, e.g. one registered by another worker; None if unknown"""
+        row = self._connection().execute(select_account, (meter_id,)).fetchone()
+        return ElectricityAccount(*row) if row else None
+
+    def add_accounts(self, accounts):
+        """Insert accounts in one transaction; returns the ones whose meter Id was not taken yet"""
+        registered = []
+        with self._transaction() as connection:
+            for account in accounts:
+                cursor = connection.execute(insert_account, (account.meter_id, account.area, account.region, account.dwelling_type))
+                if cursor.rowcount:
+                    registered.append(account)
+        return registered
+
+    def append_readings(self, rows):
+        """Insert [meter_id, date, time, reading] rows in one transaction; returns how many were new.
+
+        A row identical to one already stored, e.g. a retry another worker received first, is skipped.
+        """
+        values = [(row[0], MeterReadingBuffer.to_timestamp(row[1], row[2]), row[3]) for row in rows]
+        with self._transaction() as connection:
+            return connection.executemany(insert_reading, values).rowcount
+
+    def pending_readings(self, meter_id):
+        """One meter's readings not yet claimed by a batch job, as a MeterReadingBuffer"""
+        connection = self._connection()
+        cutoff = _cutoff(connection)
+        buffer = MeterReadingBuffer()
+        for timestamp, reading in connection.execute(select_pending_for_meter, (meter_id, cutoff)):
+            buffer.append(timestamp, reading)
+        return buffer
+
+    def claim_readings(self):
+        """Read every reading not yet processed, from all workers, for the batch job.
+
+        Returns (meter Id -> MeterReadingBuffer, last reading id). They only count as processed
+        once commit_claim(last id) runs, so a batch that fails first leaves them to the next one.
+        """
+        meter_readings = defaultdict(MeterReadingBuffer)
+        connection = self._connection()
+        cutoff = _cutoff(connection)
+        last = connection.execute("SELECT COALESCE(MAX(id), ?) FROM readings", (cutoff,)).fetchone()[0]
+        for meter_id, timestamp, reading in connection.execute(select_pending, (cutoff, last)):
+            meter_readings[meter_id].append(timestamp, reading)
+        return meter_readings, last
+
+    def commit_claim(self, last, usage_state):
+        """Mark readings up to id `last` as processed by the batch job, whose output is usage_state"""
+        with self._transaction() as connection:
+            connection.execute(update_cutoff, (last,))
+            connection.executemany(update_state, _usage_state_rows(usage_state))
+
+    def save_usage_state(self, usage_state):
+        """Record the usage files as committed, e.g. after a backfill rewrote them"""
+        with self._transaction() as connection:
+            connection.executemany(update_state, _usage_state_rows(usage_state))
+
+    def usage_state(self):
+        """The usage_file_state() last committed, or None if no batch job has committed yet"""
+        values = dict(self._connection().execute(select_usage_state))
+        files = {key.split(':')[1] for key in values}
+        if not files:
+            return None
+        return {usage_file: None if values[f"usage:{usage_file}:size"] < 0 else
+                tuple(values[f"usage:{usage_file}:{field}"] for field in ("size", "device", "inode"))
+                for usage_file in files}
+
+    def iter_readings(self, start_timestamp, end_timestamp, chunk_rows=100000):
+        """Yield chunks of (meter_id, timestamp, reading) with start <= timestamp < end, in insertion order"""
+        cursor = self._connection().execute(select_range, (start_timestamp, end_timestamp))
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield rows
+
+    def import_csv(self, csv_path, pending, chunk_rows=100000):
+        """One-off migration of the half-hourly CSV of file storage into an empty database; returns the readings imported.
+
+        The CSV also holds the readings that batch jobs already processed, so they are imported
+        behind the batch cutoff. pending (meter Id -> MeterReadingBuffer) are the readings no
+        batch processed yet, which go after it. It all runs in one transaction, so an
+        interrupted import leaves the database empty and can simply be re-run.
+        """
+        pending_rows = [(meter_id, timestamp, reading) for meter_id, buffer in pending.items()
+                        for timestamp, reading in zip(buffer.timestamps, buffer.readings)]
+        pending_keys = set(pending_rows)
+
+        imported = 0
+        with self._transaction() as connection:
+            if connection.execute("SELECT 1 FROM readings LIMIT 1").fetchone():
+                raise ValueError(f"{self.path} already holds readings")
+            if os.path.exists(csv_path):
+                with open(csv_path, 'r', newline='') as file:
+                    reader = csv.reader(file)
+                    next(reader, None)  # skip header
+                    while True:
+                        values = []
+                        for row in reader:
+                            try:
+                                meter_id, date, time_, reading = row
+                                value = (meter_id, MeterReadingBuffer.to_timestamp(date, time_), float(reading))
+                            except ValueError:
+                                continue  # blank, torn or malformed row
+                            if value not in pending_keys:
+                                values.append(value)
+                            if len(values) >= chunk_rows:
+                                break
+                        if not values:
+                            break
+                        imported += connection.executemany(insert_reading, values).rowcount
+            connection.execute(update_cutoff, (connection.execute("SELECT COALESCE(MAX(id), 0) FROM readings").fetchone()[0],))
+            imported += connection.executemany(insert_reading, pending_rows).rowcount
+        return imported
+
+    def checkpoint(self):
+        """Fold the write-ahead log back into the database file"""
+        self._connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def _usage_state_rows(usage_state):
+    for usage_file, taken in usage_state.items():
+        for field, value in zip(("size", "device", "inode"), taken or (-1, 0, 0)):
+            yield f"usage:{usage_file}:{field}", value
+
+
+def _cutoff(connection):
+    row = connection.execute(select_cutoff).fetchone()
+    return row[0] if row else 0
+
+
+if __name__ == "__main__":
+    # python sqlite_store.py: move file storage (accounts, half-hourly CSV, committed usage files) into the database
+    import utils
+    from readings_snapshot import recover_meter_readings
+
+    utils.storage_backend = "file" # read the files, whatever METER_STORAGE says
+    storage = SQLiteStorage()
+    accounts = storage.add_accounts(utils.load_electricity_accounts_from_file())
+    pending, _ = recover_meter_readings() # today's readings, after rolling back a batch that died
+    try:
+        readings = storage.import_csv(utils.half_hourly_readings_csv_filepath, pending)
+    except ValueError as e:
+        raise SystemExit(e)
+    storage.save_usage_state(utils.usage_file_state())
+    print(f"Imported {len(accounts)} account(s) and {readings} reading(s), {sum(map(len, pending.values()))} of them for the next batch.")
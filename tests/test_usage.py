@@ -0,0 +1,189 @@
+import os
+import sys
+import atexit
+import time
+import shutil
+import hashlib
+import importlib
+import subprocess
+
+import numpy as np
+import pytest
+
+import utils
+from dedup import ReadingDedupIndex
+from models.meter_reading_buffer import MeterReadingBuffer
+from utils import daily_usage_from_columns, rollback_usage_files, is_row_start
+
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+header = b"Meter_id,Region,Area,Dwelling_type,Date,Daily_Usage (kWh)\n"
+
+
+def timestamp(date, time_):
+    return MeterReadingBuffer.to_timestamp(date, time_)
+
+
+def daily_usage(meter_codes, timestamps, readings):
+    codes, days, usages = daily_usage_from_columns(meter_codes, timestamps, readings)
+    return list(zip(codes.tolist(), days.astype(str).tolist(), usages.tolist()))
+
+
+def test_daily_usage_sorts_out_of_order_readings():
+    readings = [(1, "03:00", 15.0), (0, "02:00", 4.0), (1, "01:00", 10.0), (0, "01:00", 1.0), (0, "03:00", 9.0)]
+    assert daily_usage([meter for meter, _, _ in readings],
+                       [timestamp("2025-03-05", time_) for _, time_, _ in readings],
+                       [reading for _, _, reading in readings]) == [(0, "2025-03-05", 8.0), (1, "2025-03-05", 5.0)]
+
+
+def test_daily_usage_splits_readings_at_midnight():
+    readings = [("2025-03-05", "23:00", 1.0), ("2025-03-05", "23:30", 2.0), ("2025-03-06", "00:00", 4.0), ("2025-03-06", "01:00", 7.0)]
+    assert daily_usage([0] * len(readings),
+                       [timestamp(date, time_) for date, time_, _ in readings],
+                       [reading for _, _, reading in readings]) == [(0, "2025-03-05", 1.0), (0, "2025-03-06", 3.0)]
+
+
+def test_daily_usage_keeps_the_later_of_tied_readings():
+    times = ["01:00", "02:00", "02:00", "01:00"]
+    assert daily_usage([0] * len(times), [timestamp("2025-03-05", time_) for time_ in times],
+                       [1.0, 5.0, 6.0, 2.0]) == [(0, "2025-03-05", 4.0)]
+
+
+def test_daily_usage_of_no_readings():
+    assert daily_usage(np.array([], dtype=np.int64), [], []) == []
+
+
+@pytest.fixture
+def usage_file(tmp_path):
+    path = tmp_path / "daily_usage.csv"
+    path.write_bytes(header + b"999-999-999,West,Jurong,1 room,2025-03-05,1.0\n")
+    return str(path)
+
+
+def file_state(path):
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_dev, stat.st_ino)
+
+
+def test_rollback_truncates_appended_rows(usage_file):
+    state = {usage_file: file_state(usage_file)}
+    committed = open(usage_file, 'rb').read()
+    with open(usage_file, 'ab') as file:
+        file.write(b"999-999-999,West,Jurong,1 room,2025-03-06,2.0\n")
+
+    assert rollback_usage_files(state)
+    assert open(usage_file, 'rb').read() == committed
+    assert not rollback_usage_files(state)
+
+
+def test_rollback_removes_a_file_the_batch_created(tmp_path, usage_file):
+    assert rollback_usage_files({usage_file: None})
+    assert not os.path.exists(usage_file)
+    assert not rollback_usage_files({str(tmp_path / "monthly_usage.csv"): None})
+
+
+def test_rollback_leaves_a_replaced_file(usage_file):
+    state = {usage_file: file_state(usage_file)}
+    replacement = usage_file + ".tmp"
+    with open(replacement, 'wb') as file:
+        file.write(header + b"999-999-999,West,Jurong,1 room,2025-03-05,1.5\n" * 2)
+    os.replace(replacement, usage_file)
+    backfilled = open(usage_file, 'rb').read()
+
+    assert not rollback_usage_files(state)
+    assert open(usage_file, 'rb').read() == backfilled
+
+
+def test_is_row_start(usage_file):
+    size = os.path.getsize(usage_file)
+    assert is_row_start(usage_file, len(header))
+    assert is_row_start(usage_file, size)
+    assert not is_row_start(usage_file, len(header) + 1)
+    assert not is_row_start(usage_file, 0)
+    assert not is_row_start(usage_file, size + 1)
+
+
+def test_dedup_drops_retries_and_lets_corrections_through():
+    index = ReadingDedupIndex(capacity=1000)
+    first, second = timestamp("2025-03-05", "01:00"), timestamp("2025-03-05", "01:30")
+    index.record("999-999-999", first, 1.0)
+    index.record("999-999-999", second, 2.0)
+
+    assert index.check("999-999-999", second, 2.0) == "latest"
+    assert index.check("999-999-999", first, 1.0) == "filter"
+    assert index.check("999-999-999", first, 1.5) is None
+    assert index.check("999-999-999", timestamp("2025-03-05", "02:00"), 2.0) is None
+    assert index.check("999-999-998", second, 2.0) is None
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """A fresh app module serving a scratch copy of archived_data"""
+    os.makedirs(tmp_path / "archived_data")
+    for name in ("electricity_accounts.json", "daily_usage.csv", "monthly_usage.csv"):
+        shutil.copy(os.path.join(repo_dir, "archived_data", name), tmp_path / "archived_data")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(utils, "file_path", str(tmp_path / "archived_data" / "electricity_accounts.json"))
+    monkeypatch.setattr(utils, "accounts_log_path", str(tmp_path / "archived_data" / "electricity_accounts.jsonl"))
+    monkeypatch.setattr(utils, "storage_backend", "file")
+
+    sys.modules.pop("app", None)
+    module = importlib.import_module("app")
+    yield module
+    # Shut down what the import started now, while the scratch copy is still the working directory
+    for shutdown in (module.checkpoint_readings, module.half_hourly_writer.close, module.log_listener.stop):
+        atexit.unregister(shutdown)
+    module.half_hourly_writer.close()
+    module.log_listener.stop()
+    sys.modules.pop("app", None)
+
+
+def run_batch(app):
+    assert app.app.test_client().post("/stop_server").status_code == 202
+    deadline = time.time() + 30
+    while app.batch_status["state"] == "running" and time.time() < deadline:
+        time.sleep(0.01)
+    return app.batch_status["state"]
+
+
+def test_failed_batch_rolls_back_and_returns_its_readings(app):
+    usage_files = lambda: {path: hashlib.md5(open(path, 'rb').read()).hexdigest() for path in (utils.daily_file, utils.monthly_file)}
+    meter_id = next(iter(app.meter_registry)).meter_id
+    client = app.app.test_client()
+    for time_, reading in (("01:00", 20.0), ("02:00", 23.0)):
+        response = client.post("/meter-readings", data=dict(meter_id=meter_id, date="2026-10-01", time=time_, electricity_reading=reading))
+        assert response.status_code in (200, 202), response.json
+    committed = usage_files()
+
+    def fail_archive(snapshot):
+        raise IOError("disk full")
+    app.reading_store.append_buffers = fail_archive
+    assert run_batch(app) == "failed"
+    assert app.batch_status["phase"] is None
+    assert usage_files() == committed
+    assert not app.batch_in_flight
+    assert list(app.meter_readings[meter_id].readings) == [20.0, 23.0]
+
+    del app.reading_store.append_buffers
+    assert run_batch(app) == "completed"
+    rows = [row for row in open(utils.daily_file).read().splitlines() if row.startswith(meter_id) and ",2026-10-01," in row]
+    assert len(rows) == 1 and rows[0].endswith(",3.0")
+
+
+def test_backfill_cli_splits_the_readings_across_workers(tmp_path):
+    os.makedirs(tmp_path / "archived_data")
+    for name in ("electricity_accounts.json", "daily_usage.csv", "monthly_usage.csv"):
+        shutil.copy(os.path.join(repo_dir, "archived_data", name), tmp_path / "archived_data")
+    # Enough readings for two workers of backfill_min_bytes_per_worker each
+    slots = [f"{slot // 2:02d}:{slot % 2 * 30:02d}" for slot in range(48)]
+    with open(tmp_path / "archived_data" / "half_hourly_readings.csv", "w") as file:
+        file.write("Meter Id,Date,Time,Electricity Reading (kWh)\n")
+        for day in range(1, 29):
+            file.write("".join(f"999-999-999,2025-03-{day:02d},{time_},{day * 48 + slot}.0\n" for slot, time_ in enumerate(slots)) * 360)
+
+    env = dict(os.environ, PYTHONPATH=repo_dir, METER_LOG_LEVEL="WARNING")
+    result = subprocess.run([sys.executable, os.path.join(repo_dir, "backfill.py"), "--start", "2025-03-01", "--end", "2025-03-31", "--workers", "2"],
+                            cwd=tmp_path, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert "'daily_rows_written': 28" in result.stdout
+    assert "999-999-999,West,Jurong,1 room,2025-03-05,47.0\n" in open(tmp_path / "archived_data" / "daily_usage.csv").read()
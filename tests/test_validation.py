@@ -0,0 +1,24 @@
+import itertools
+
+from validation import validate_reading, validate_readings
+
+
+meter_ids = ["123-456-789", "12-456-789", "123-456-7890", "123_456_789", "１２３-456-789", "", None, 123, ["123-456-789"]]
+dates = ["2025-03-05", "2025-3-5", "2025-02-30", "2024-02-29", "2025-13-01", "", None, ["2025-03-05"]]
+times = ["01:30", "1:5", "24:00", "", None, {"time": "01:30"}]
+readings = ["1.5", 2, 0, "-0.5", "nan", "inf", "x", "", None, [1]]
+
+
+def test_batch_validation_matches_one_reading_at_a_time():
+    rows = list(itertools.product(meter_ids, dates, times, readings))
+    errors, timestamps, values = validate_readings(*map(list, zip(*rows)))
+
+    assert len(errors) == len(timestamps) == len(values) == len(rows)
+    for row, error, timestamp, value in zip(rows, errors, timestamps, values):
+        expected_error, expected_timestamp, expected_value = validate_reading(*row)
+        assert (error, timestamp, value) == (expected_error, expected_timestamp or 0, expected_value or 0.0), row
+
+
+def test_batch_validation_of_no_readings():
+    errors, timestamps, values = validate_readings([], [], [], [])
+    assert (errors, len(timestamps), len(values)) == ([], 0, 0)
@@ -0,0 +1,139 @@
+import os
+import csv
+import threading
+from bisect import bisect_left, bisect_right
+
+
+def parse_row(line):
+    """A usage CSV line as a row, or None if blank. csv.writer only quotes fields that need it, so unquoted lines are split directly"""
+    text = line.decode()
+    if '"' in text:
+        return next(csv.reader([text]), None)
+    text = text.rstrip("\r\n")
+    return text.split(",") if text else None
+
+
+class UsageFileIndex:
+    """Per-meter index of row byte offsets in an append-only usage CSV, sorted by period.
+
+    A later row for the same meter and period (date, or month in the monthly file) supersedes
+    the earlier one, so only the latest row of each period is indexed. visit(row, the row it
+    supersedes or None) is called for every row the first pass reads, so whatever else is built
+    from the file can be built in the same pass.
+    """
+
+    def __init__(self, usage_file, visit=None):
+        self.usage_file = usage_file
+        self._entries = {} # meter_id -> ([periods], [byte offsets]), sorted by period
+        self._indexed_size = 0
+        self._file_id = None # (device, inode) of the file indexed, to notice it being replaced
+        self._lock = threading.Lock()
+        self.refresh(visit)
+
+    def refresh(self, visit=None):
+        """Index the rows appended to the file since the last refresh, or all of them if it was replaced"""
+        if not os.path.exists(self.usage_file):
+            return
+        with open(self.usage_file, 'rb') as file:
+            self._index(file, visit)
+
+    def _open(self):
+        """Open the file to read rows at indexed offsets, indexing it first if it was replaced since"""
+        file = open(self.usage_file, 'rb')
+        stat = os.fstat(file.fileno())
+        if (stat.st_dev, stat.st_ino) != self._file_id:
+            # e.g. swapped in by a backfill that hasn't refreshed the index yet
+            self._index(file)
+        return file
+
+    def _index(self, file, visit=None):
+        with self._lock:
+            stat = os.fstat(file.fileno())
+            entries, indexed_size = self._entries, self._indexed_size
+            if (stat.st_dev, stat.st_ino) != self._file_id or stat.st_size < indexed_size:
+                # Rewritten rather than appended to, e.g. compacted or backfilled: index it aside, then swap
+                entries, indexed_size = {}, 0
+                file.seek(0)
+                file.readline()  # skip header
+                indexed_size = file.tell()
+            else:
+                file.seek(indexed_size)
+
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break  # a row still being written
+                offset, indexed_size = indexed_size, indexed_size + len(line)
+
+                row = parse_row(line)
+                if not row:
+                    continue
+                dates, offsets = entries.setdefault(row[0], ([], []))
+                position = bisect_left(dates, row[4])
+                if position < len(dates) and dates[position] == row[4]:
+                    if visit is not None:
+                        visit(row, self._read_row(file, offsets[position]))
+                    offsets[position] = offset
+                else:
+                    dates.insert(position, row[4])
+                    offsets.insert(position, offset)
+                    if visit is not None:
+                        visit(row, None)
+
+            self._entries, self._indexed_size, self._file_id = entries, indexed_size, (stat.st_dev, stat.st_ino)
+
+    @staticmethod
+    def _read_row(file, offset):
+        """The row at a byte offset, leaving the file where it was"""
+        position = file.tell()
+        file.seek(offset)
+        row = parse_row(file.readline())
+        file.seek(position)
+        return row
+
+    def _row_offset(self, meter_id, period):
+        dates, offsets = self._entries.get(meter_id, ((), ()))
+        position = bisect_left(dates, period)
+        return offsets[position] if position < len(dates) and dates[position] == period else None
+
+    def row(self, meter_id, period):
+        """The latest row of one meter and period, or None without touching the file if there is none"""
+        if self._row_offset(meter_id, period) is None:
+            return None
+        with self._open() as file:
+            offset = self._row_offset(meter_id, period)
+            if offset is None:
+                return None
+            file.seek(offset)
+            return parse_row(file.readline())
+
+    def lookup(self, meter_id, start_date=None, end_date=None):
+        """Rows of one meter from start_date to end_date inclusive, by binary search and direct seeks"""
+        rows = []
+        if not os.path.exists(self.usage_file):
+            return rows
+        with self._open() as file:
+            dates, offsets = self._entries.get(meter_id, ([], []))
+            low = bisect_left(dates, start_date) if start_date else 0
+            high = bisect_right(dates, end_date) if end_date else len(dates)
+            for offset in offsets[low:high]:
+                file.seek(offset)
+                rows.append(parse_row(file.readline()))
+        return rows
+
+    def latest_rows(self, offset=None):
+        """Yield (row, byte offset just past the row) like read_usage_rows, leaving out superseded rows"""
+        self.refresh()
+        with self._open() as file:
+            if offset is None:
+                file.readline()  # skip header
+            else:
+                file.seek(offset)
+            while True:
+                start = file.tell()
+                line = file.readline()
+                if not line:
+                    return
+                row = parse_row(line)
+                # Rows appended since the refresh are not indexed yet, and are the latest so far
+                if row and self._row_offset(row[0], row[4]) in (start, None):
+                    yield row, file.tell()
@@ -1,60 +1,229 @@
 import os
 import csv
-import pandas as pd
 from datetime import datetime
-import pytz
+import gzip
+import io
 import json
-import re
-
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from collections import defaultdict
+from operator import itemgetter
+from logging.handlers import QueueHandler, QueueListener
+from urllib.parse import quote
+
+from lazy_import import lazy_import
 from models.electricity_account import ElectricityAccount
+from sqlite_store import SQLiteStorage
+from process_pool import run_in_process_pool
+from usage_index import UsageFileIndex
+from rollup_cube import UsageRollupCube
+from validation import is_valid_meter_id, date_seconds
+from metrics import csv_append_duration_seconds, csv_append_bytes_total, csv_append_rows_total, dedup_duplicates_total
+
+# Only the batch job and range reads need numpy, so it loads on first use rather than at worker startup
+np = lazy_import('numpy')
 
 
-file_path = os.path.join(os.getcwd(), 'archived_data', 'electricity_accounts.json')
+file_path = os.path.join(os.getcwd(), 'archived_data', 'electricity_accounts.json') # compacted snapshot
+accounts_log_path = os.path.join(os.getcwd(), 'archived_data', 'electricity_accounts.jsonl') # registrations since the snapshot
 half_hourly_readings_csv_filepath = 'archived_data/half_hourly_readings.csv'
 daily_file = "archived_data/daily_usage.csv"
 monthly_file = "archived_data/monthly_usage.csv"
+rendered_dir = os.path.join('archived_data', 'rendered') # pre-rendered /meters/daily and /meters/monthly bodies
+
+# Where accounts and half-hourly readings are stored: "file" (JSON account snapshot and log, half-hourly
+# CSV; one server process) or "sqlite" (one WAL-mode database shared by several worker processes)
+storage_backend = os.environ.get("METER_STORAGE", "file")
+_sqlite_storage = None
+
+# Compact the account log into the snapshot once it holds this many entries
+accounts_compact_threshold = 10000
+accounts_log_entries = 0
+accounts_lock = threading.RLock()
+
+# Write-behind settings for the half-hourly CSV
+half_hourly_flush_rows = int(os.environ.get("METER_FLUSH_ROWS", 500)) # group commit once this many rows are queued
+half_hourly_flush_interval_ms = int(os.environ.get("METER_FLUSH_INTERVAL_MS", 200)) # ... or once the oldest queued row is this old
+half_hourly_fsync_policy = os.environ.get("METER_FSYNC_POLICY", "commit") # "none": leave it to the OS, "commit": fsync every group commit
+half_hourly_strict = os.environ.get("METER_STRICT_DURABILITY", "0").lower() in ("1", "true", "yes") # acknowledge a reading only once it is durable
+
+# Monthly usage is appended as the batch touches it and compacted once the file holds as many
+# superseded rows (an earlier row for the same meter and month) as live ones
+monthly_superseded_rows = 0
+
+# Nightly batch: daily usage per meter Id shard and the monthly file's CSV in chunks, in a process pool
+batch_workers = int(os.environ.get("METER_BATCH_WORKERS", os.cpu_count() or 1))
+batch_min_meters_per_worker = 10000 # below this the pool costs more than it saves, so run in-process
+batch_min_rows_per_worker = 100000
+
+# Service log; per-row messages are DEBUG so they cost nothing at the default level
+logger = logging.getLogger("electricity_meter")
+log_level = os.environ.get("METER_LOG_LEVEL", "INFO")
+
+
+def configure_logging(level=log_level):
+    """Log through a queue so request threads never wait on the console; returns the listener to stop at exit"""
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(threadName)s] %(message)s"))
+    listener = QueueListener(log_queue, handler)
+    logger.handlers[:] = [QueueHandler(log_queue)]
+    logger.setLevel(level)
+    logger.propagate = False
+    listener.start()
+    return listener
+
+
+def sqlite_storage():
+    """The process's SQLiteStorage, opened on first use"""
+    global _sqlite_storage
+
+    if _sqlite_storage is None:
+        _sqlite_storage = SQLiteStorage(synchronous="FULL" if half_hourly_fsync_policy == "commit" else "NORMAL")
+    return _sqlite_storage
+
+
+def shared_storage():
+    """True when several worker processes share the storage, so process memory only holds part of the state"""
+    return storage_backend == "sqlite"
+
+
+def load_registered_account(meter_id):
+    """Fallback for MeterRegistry: an account another worker process registered, or None"""
+    return sqlite_storage().get_account(meter_id) if shared_storage() else None
 
 
 # Load existing accounts
 def load_electricity_accounts_from_file():
-    """Load all meter accounts from file"""
+    """Load all meter accounts from the snapshot file, then replay the append-only log"""
+    global accounts_log_entries
+
+    if shared_storage():
+        return sqlite_storage().load_accounts()
+
     if not os.path.exists(file_path):
         with open(file_path, "w") as file:
             json.dump([], file)
-        return []
 
     try:
         with open(file_path, "r") as file:
             data = json.load(file)
-            return [ElectricityAccount.from_dict(account) for account in data]
     except json.JSONDecodeError:
-        return []
+        data = []
+
+    accounts_log_entries = 0
+    if os.path.exists(accounts_log_path):
+        with open(accounts_log_path, "rb+") as file:
+            good_size = 0
+            for line in file:
+                # A torn last line from a crash mid-append, nothing was acknowledged for it
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    data.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+                accounts_log_entries += 1
+                good_size += len(line)
+            # Drop the torn tail so the next append starts on a fresh line
+            file.truncate(good_size)
+
+    return [ElectricityAccount.from_dict(account) for account in data]
 
 
 # Save a new meter to the file
-def save_electricity_accounts_to_file(electricity_account: ElectricityAccount, meter_list, meter_accounts):
+def save_electricity_accounts_to_file(electricity_account: ElectricityAccount, meter_registry):
     """Save a new meter to the file"""
-    # Check if meter_id already exists
-    if electricity_account.meter_id in meter_list:
+    if not save_electricity_accounts_batch_to_file([electricity_account], meter_registry):
         return False, "Meter ID already registered"
+    return True, "Meter registered successfully"
 
-    # Add new account and save all accounts
-    meter_accounts.append(electricity_account)
 
-    # Convert all accounts to dictionaries for JSON serialization
-    accounts_dict = [account.to_dict() for account in meter_accounts]
+def save_electricity_accounts_batch_to_file(electricity_accounts, meter_registry):
+    """Register many meters and append them to the account log in one write; return the ones registered"""
+    global accounts_log_entries
 
-    with open(file_path, 'w') as f:
-        json.dump(accounts_dict, f, indent=4)
-    return True, "Meter registered successfully"
+    if shared_storage():
+        # The database decides which meter Ids are taken, across all workers
+        registered = sqlite_storage().add_accounts(electricity_accounts)
+        for account in registered:
+            meter_registry.add(account)
+        return registered
 
+    with accounts_lock:
+        # Add new accounts, unless the meter_id already exists
+        registered = [account for account in electricity_accounts if meter_registry.add(account)]
+        if not registered:
+            return registered
 
-# Validate meter ID format (XXX-XXX-XXX, digits only)
-def is_valid_meter_id(meter_id):
-    return bool(re.fullmatch(r"\d{3}-\d{3}-\d{3}", meter_id))
+        with open(accounts_log_path, 'a') as f:
+            f.write("".join(json.dumps(account.to_dict()) + "\n" for account in registered))
+            f.flush()
+            os.fsync(f.fileno())
+        accounts_log_entries += len(registered)
 
+        if accounts_log_entries >= accounts_compact_threshold:
+            compact_electricity_accounts(meter_registry)
+    return registered
+
+
+def compact_electricity_accounts(meter_registry):
+    """Fold the account log into the snapshot file with an atomic rename, then empty the log"""
+    global accounts_log_entries
+
+    if shared_storage():
+        sqlite_storage().checkpoint()
+        return
+
+    with accounts_lock:
+        # Convert all accounts to dictionaries for JSON serialization
+        accounts_dict = [account.to_dict() for account in meter_registry]
+
+        tmp_file = file_path + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(accounts_dict, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, file_path)
+
+        # A crash before this point only leaves entries that replay as duplicates
+        open(accounts_log_path, 'w').close()
+        accounts_log_entries = 0
+    logger.info("Compacted %d accounts into %s.", len(accounts_dict), file_path)
+
+
+_month_keys = {} # "2024-May" -> "2024-05"
+
+
+def usage_period_key(period):
+    """Sort key of a usage row's period: a YYYY-MM-DD date as is, a YYYY-Mon month as YYYY-MM"""
+    if len(period) == 10:
+        return period
+    key = _month_keys.get(period)
+    if key is None:
+        key = _month_keys[period] = datetime.strptime(period, "%Y-%b").strftime("%Y-%m")
+    return key
+
+
+def append_to_half_hourly_csv(rows, fsync=False):
+    """Append reading rows to the half-hourly CSV with a single open/write"""
+    if shared_storage():
+        started = time.perf_counter()
+        try:
+            inserted = sqlite_storage().append_readings(rows)
+        except sqlite3.Error as e:
+            raise IOError(f"Error writing to database: {e}") from e
+        csv_append_duration_seconds.observe(time.perf_counter() - started)
+        csv_append_rows_total.inc(inserted)
+        if inserted < len(rows):
+            dedup_duplicates_total.inc(len(rows) - inserted, index="database")
+        return
 
-async def save_to_half_hourly_csv(data):
     file_exists = os.path.exists(half_hourly_readings_csv_filepath)
 
     # If file doesn't exist, create it with headers
@@ -64,24 +233,275 @@ async def save_to_half_hourly_csv(data):
             writer.writerow(['Meter Id', 'Date', 'Time', 'Electricity Reading (kWh)'])
 
     # Append the new data
-    try:
-        with open(half_hourly_readings_csv_filepath, 'a', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(data)
-            print(f"Successfully appended: {data}")
-    except IOError as e:
-        print(f"Error writing to file: {e}")
-        raise
-
-def calculate_daily_usage(meter_accounts, meter_readings):
-    """Calculate daily electricity usage and save to CSV."""
-    daily_usage_data = []
-
-    for meter_id, readings in meter_readings.items():
-        account = next((meter for meter in meter_accounts if meter.meter_id == meter_id), None)
+    started = time.perf_counter()
+    with open(half_hourly_readings_csv_filepath, 'a', newline='') as file:
+        start_offset = file.tell()
+        writer = csv.writer(file)
+        writer.writerows(rows)
+        if fsync:
+            file.flush()
+            os.fsync(file.fileno())
+        csv_append_bytes_total.inc(file.tell() - start_offset)
+    csv_append_duration_seconds.observe(time.perf_counter() - started)
+    csv_append_rows_total.inc(len(rows))
+
+
+class HalfHourlyWriter:
+    """Write-behind buffer that group-commits reading rows to the half-hourly CSV"""
+
+    def __init__(self, flush_rows=half_hourly_flush_rows, flush_interval_ms=half_hourly_flush_interval_ms,
+                 fsync_policy=half_hourly_fsync_policy, strict=half_hourly_strict):
+        if fsync_policy not in ("none", "commit"):
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        self.flush_rows = flush_rows
+        self.flush_interval_ms = flush_interval_ms
+        self.fsync_policy = fsync_policy
+        self.strict = strict
+
+        self._cond = threading.Condition()
+        self._rows = []
+        self._enqueued = 0 # rows ever queued
+        self._flushed = 0 # rows ever written
+        self._flush_requested = False
+        self._closed = False
+        self._error = None
+
+        self._thread = threading.Thread(target=self._run, name="half-hourly-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, rows):
+        """Queue rows for writing and return their sequence number, to pass to acknowledge()"""
+        with self._cond:
+            if self._closed:
+                raise IOError("Half-hourly writer is closed")
+            self._rows.extend(rows)
+            self._enqueued += len(rows)
+            seq = self._enqueued
+            if len(self._rows) >= self.flush_rows or self.strict:
+                self._flush_requested = True
+            self._cond.notify_all()
+        return seq
+
+    def acknowledge(self, seq):
+        """Return once rows up to seq may be acknowledged: at once, or once durable in strict mode"""
+        if self.strict:
+            self._wait_for(seq)
+
+    def flush(self):
+        """Flush barrier: return once every row queued so far is written"""
+        with self._cond:
+            seq = self._enqueued
+            if self._flushed >= seq:
+                return
+            self._flush_requested = True
+            self._cond.notify_all()
+        self._wait_for(seq)
+
+    def close(self):
+        """Flush what is left and stop the background writer"""
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _wait_for(self, seq):
+        with self._cond:
+            while self._flushed < seq:
+                if self._error is not None:
+                    raise IOError(f"Error writing to file: {self._error}")
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # Sleep until there is something to write
+                while not self._rows and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._rows:
+                    return
+
+                # Give the group a chance to fill up before committing it
+                deadline = time.monotonic() + self.flush_interval_ms / 1000
+                while len(self._rows) < self.flush_rows and not self._flush_requested and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                rows, self._rows = self._rows, []
+                self._flush_requested = False
+
+            try:
+                append_to_half_hourly_csv(rows, fsync=self.fsync_policy == "commit")
+            except IOError as e:
+                logger.error("Error writing to file: %s", e)
+                with self._cond:
+                    # Put the rows back in front and retry on the next tick
+                    self._rows[:0] = rows
+                    self._error = e
+                    self._cond.notify_all()
+                time.sleep(self.flush_interval_ms / 1000)
+                continue
+
+            with self._cond:
+                self._flushed += len(rows)
+                self._error = None
+                self._cond.notify_all()
+            logger.debug("Successfully appended %d row(s)", len(rows))
+
+def daily_usage_from_columns(meter_codes, timestamps, readings):
+    """Vectorized daily usage over half-hourly readings given as columns.
+
+    Sorts by (meter, timestamp) and, for every (meter, UTC day) group, takes the last
+    cumulative reading minus the first. A meter keeps one reading per timestamp, the later
+    one in the input, so corrections win. Returns (meter_codes, days, usages) arrays, with
+    days as datetime64[D], ordered by meter then day.
+    """
+    meter_codes = np.asarray(meter_codes)
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    readings = np.asarray(readings, dtype=np.float64)
+    if not len(timestamps):
+        return meter_codes[:0], np.array([], dtype='datetime64[D]'), readings[:0]
+
+    order = np.lexsort((timestamps, meter_codes)) # stable, so ties keep their input order
+    meter_codes = meter_codes[order]
+    timestamps = timestamps[order]
+    readings = readings[order]
+
+    last = np.ones(len(timestamps), dtype=bool)
+    last[:-1] = (meter_codes[1:] != meter_codes[:-1]) | (timestamps[1:] != timestamps[:-1])
+    if not last.all():
+        meter_codes, timestamps, readings = meter_codes[last], timestamps[last], readings[last]
+    days = timestamps // 86400
+
+    # A group starts wherever the meter or the day changes
+    boundary = np.empty(len(days), dtype=bool)
+    boundary[0] = True
+    np.not_equal(meter_codes[1:], meter_codes[:-1], out=boundary[1:])
+    boundary[1:] |= days[1:] != days[:-1]
+    starts = np.flatnonzero(boundary)
+    ends = np.append(starts[1:], len(days)) - 1
+
+    return meter_codes[starts], days[starts].astype('datetime64[D]'), readings[ends] - readings[starts]
+
+
+def meter_shard(meter_id, shards):
+    """Shard of a meter Id; crc32 rather than hash() so it is the same in every process and run"""
+    return zlib.crc32(meter_id.encode()) % shards
+
+
+def daily_usage_shard(meters):
+    """Lay [(meter_id, region, area, dwelling_type, MeterReadingBuffer)] out as columns, sorted by meter Id.
+
+    Returns (accounts, reading counts, timestamps, readings), the accounts as 4-tuples and the
+    rest as typed arrays, so a shard pickles as a few flat buffers rather than a buffer per meter.
+    """
+    meters = sorted(meters, key=itemgetter(0))
+    counts, timestamps, readings = array('q'), array('q'), array('d')
+    for meter in meters:
+        buffer = meter[4]
+        counts.append(len(buffer))
+        timestamps.extend(buffer.timestamps)
+        readings.extend(buffer.readings)
+    return [meter[:4] for meter in meters], counts, timestamps, readings
+
+
+def daily_usage_rows(shard):
+    """Daily usage rows of a daily_usage_shard(), ordered by meter Id then date"""
+    accounts, counts, timestamps, readings = shard
+    if not accounts:
+        return []
 
-        daily_usage = readings[-1].electricity_reading - readings[0].electricity_reading
-        daily_usage_data.append([meter_id, account.region, account.area, account.dwelling_type, readings[0].date, daily_usage])
+    meter_codes = np.repeat(np.arange(len(accounts)), np.frombuffer(counts, dtype=np.int64))
+    codes, days, usages = daily_usage_from_columns(meter_codes, np.frombuffer(timestamps, dtype=np.int64),
+                                                   np.frombuffer(readings, dtype=np.float64))
+
+    rows = []
+    for code, date, daily_usage in zip(codes.tolist(), days.astype(str).tolist(), usages.tolist()):
+        meter_id, region, area, dwelling_type = accounts[code]
+        rows.append([meter_id, region, area, dwelling_type, date, daily_usage])
+    return rows
+
+
+def usage_csv_text(rows):
+    """Rows formatted as CSV lines"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def fold_late_days(rows, meter_readings, daily_usage_index, reading_store):
+    """Pair each daily usage row with None if its day is new, or with the change if the day already has a row.
+
+    A day that already has a row got readings after its batch. Its usage is recomputed over
+    the day's archived readings plus the late ones, later readings winning timestamp ties; the
+    returned row supersedes the old one. Days left unchanged, or with nothing archived to fold
+    into, are dropped.
+    """
+    folded = []
+    unarchived = 0
+    for row in rows:
+        meter_id, date = row[0], row[4]
+        previous = daily_usage_index.row(meter_id, date)
+        if previous is None:
+            folded.append((row, None))
+            continue
+
+        timestamps, readings = reading_store.meter_range(meter_id, date, date)
+        if not len(timestamps):
+            unarchived += 1
+            continue
+        day = date_seconds(date)
+        buffer = meter_readings[meter_id]
+        day_readings = list(zip(timestamps.tolist(), readings.tolist()))
+        day_readings += [(timestamp, reading) for timestamp, reading in zip(buffer.timestamps, buffer.readings) if day <= timestamp < day + 86400]
+        first = last = day_readings[0]
+        for reading in day_readings[1:]:
+            if reading[0] <= first[0]:
+                first = reading
+            if reading[0] >= last[0]:
+                last = reading
+
+        daily_usage = last[1] - first[1]
+        change = daily_usage - float(previous[5])
+        if change:
+            folded.append((row[:5] + [daily_usage], change))
+
+    if unarchived:
+        logger.warning("%d late day(s) have no archived readings to fold into and were left as they are; run backfill.py for them.", unarchived)
+    return folded
+
+
+def calculate_daily_usage(meter_registry, meter_readings, latest_daily_usage=None, usage_cube=None, workers=None,
+                          daily_usage_index=None, reading_store=None):
+    """Calculate daily electricity usage and save to CSV.
+
+    With daily_usage_index and reading_store, a day that already has a row is folded into it
+    (see fold_late_days) rather than given a second one. Returns the rows to fold into the
+    monthly rollup: a new day's usage, or the change of a late one.
+    """
+    meters = []
+    for meter_id, buffer in meter_readings.items():
+        if buffer:
+            account = meter_registry.get(meter_id)
+            meters.append((meter_id, account.region, account.area, account.dwelling_type, buffer))
+
+    # Shard the meters by meter Id hash; a meter's rows all come from one shard, already ordered by
+    # date, so a stable sort on the meter Id merges them in the same order whatever the worker count
+    workers = min(workers or batch_workers, len(meters) // batch_min_meters_per_worker) or 1
+    shards = [[] for _ in range(workers)]
+    for meter in meters:
+        shards[meter_shard(meter[0], workers)].append(meter)
+    daily_usage_data = [row for rows in run_in_process_pool(daily_usage_rows, [daily_usage_shard(shard) for shard in shards]) for row in rows]
+    if workers > 1:
+        daily_usage_data.sort(key=itemgetter(0))
+
+    if daily_usage_index is not None and reading_store is not None:
+        folded = fold_late_days(daily_usage_data, meter_readings, daily_usage_index, reading_store)
+        daily_usage_data = [row for row, _ in folded]
+    else:
+        folded = [(row, None) for row in daily_usage_data]
 
     daily_exists = os.path.exists(daily_file)
 
@@ -93,62 +513,327 @@ def calculate_daily_usage(meter_accounts, meter_readings):
             if not daily_exists:
                 writer.writerow(["Meter_id", "Region", "Area", "Dwelling_type", "Date", "Daily_Usage (kWh)"])
             
-            for row in daily_usage_data:
-                writer.writerow(row)
-                print(f"Successfully appended: {row}")
+            writer.writerows(daily_usage_data)
+            logger.info("Successfully appended %d daily usage row(s)", len(daily_usage_data))
     except IOError as e:
-        print(f"Error writing to file: {e}")
+        logger.error("Error writing to file: %s", e)
         raise
 
-
-def calculate_monthly_usage():
-    """Calculate monthly electricity usage and save to CSV."""
-    if not os.path.exists(daily_file):
-        print(f"Error: {daily_file} does not exist.")
+    # Keep the latest-usage index in step with the file, a late day doesn't replace a later one
+    if latest_daily_usage is not None:
+        for row in daily_usage_data:
+            latest = latest_daily_usage.get(row[0])
+            if latest is None or row[4] >= latest[4]:
+                latest_daily_usage[row[0]] = [str(value) for value in row]
+
+    if usage_cube is not None:
+        for (meter_id, region, area, dwelling_type, date, daily_usage), change in folded:
+            # A late day's meter is already counted for that day
+            if change is None:
+                usage_cube.add("day", date, region, area, dwelling_type, daily_usage)
+            else:
+                usage_cube.add("day", date, region, area, dwelling_type, change, count=0)
+
+    return [row if change is None else row[:5] + [change] for row, change in folded]
+
+
+def usage_file_state():
+    """(size, device, inode) of the daily and monthly usage files (None if missing), to roll a batch back to"""
+    state = {}
+    for usage_file in (daily_file, monthly_file):
+        if os.path.exists(usage_file):
+            stat = os.stat(usage_file)
+            state[usage_file] = (stat.st_size, stat.st_dev, stat.st_ino)
+        else:
+            state[usage_file] = None
+    return state
+
+
+def rollback_usage_files(state):
+    """Drop the rows appended to the usage files since usage_file_state() returned state.
+
+    Both files are append-only between batches, so truncating them undoes a batch that failed
+    part-way. A file replaced since, i.e. rewritten by a backfill, is left as it is. Returns
+    whether anything was rolled back.
+    """
+    rolled_back = False
+    for usage_file, taken in state.items():
+        if not os.path.exists(usage_file):
+            continue
+        if taken is None:
+            os.remove(usage_file)
+            logger.warning("Rolled back %s: removed it.", usage_file)
+            rolled_back = True
+            continue
+        size, device, inode = taken
+        stat = os.stat(usage_file)
+        if (stat.st_dev, stat.st_ino) == (device, inode) and stat.st_size > size:
+            with open(usage_file, 'rb+') as file:
+                file.truncate(size)
+            logger.warning("Rolled back %s to %d bytes.", usage_file, size)
+            rolled_back = True
+    return rolled_back
+
+
+# Read usage rows lazily, for paginated and streamed responses
+def read_usage_rows(usage_file, offset=None):
+    """Yield (row, byte offset just past the row) from a usage CSV, skipping the header unless resuming at offset"""
+    with open(usage_file, 'rb') as file:
+        if offset is None:
+            file.readline()  # skip header
+        else:
+            file.seek(offset)
+        for line in iter(file.readline, b''):
+            row = next(csv.reader([line.decode()]), None)
+            if row:
+                yield row, file.tell()
+
+
+def is_row_start(usage_file, offset):
+    """True if a byte offset is where a data row of a usage CSV starts, or its end, so reading can resume there"""
+    with open(usage_file, 'rb') as file:
+        if not 0 < offset <= os.fstat(file.fileno()).st_size:
+            return False
+        file.seek(offset - 1)
+        return file.read(1) == b'\n'
+
+
+# Rows of the usage files as returned by /meters/daily and /meters/monthly
+def daily_row_to_reading(row):
+    return {
+        "region": row[1],
+        "area": row[2],
+        "dwelling_type": row[3],
+        "date": row[4],
+        "usage": row[5]
+    }
+
+
+def monthly_row_to_reading(row):
+    return {
+        "region": row[1],
+        "area": row[2],
+        "dwelling_type": row[3],
+        "date": row[4],
+        "usage": float(row[5])
+    }
+
+
+def rendered_usage_path(name, region=None):
+    """Path of a pre-rendered JSON body, for all regions or one region's slice; add .gz for the compressed copy"""
+    suffix = f".region-{quote(region, safe='')}" if region else ""
+    return os.path.join(rendered_dir, f"{name}{suffix}.json")
+
+
+def is_rendered_usage_stale(usage_file, name):
+    if not os.path.exists(usage_file):
+        return False
+    path = rendered_usage_path(name)
+    return not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(usage_file)
+
+
+def render_usage_snapshots(usage_file, name, to_reading, usage_index=None):
+    """Pre-render the {"readings": [...]} body of a usage file, and of each region's slice, as plain and gzip JSON.
+
+    With the file's UsageFileIndex, rows superseded by a later row are left out.
+    """
+    if not os.path.exists(usage_file):
         return
+    os.makedirs(rendered_dir, exist_ok=True)
 
-    df = pd.read_csv(daily_file)
-    if df.empty:
-        print(f"Error: {daily_file} is empty.")
+    outputs = {} # region (None for all) -> (path, plain file, gzip file)
+    tmp = f".{os.getpid()}.tmp" # workers starting together in shared mode each render their own copy
+    try:
+        for row, _ in (usage_index.latest_rows() if usage_index is not None else read_usage_rows(usage_file)):
+            reading = json.dumps(to_reading(row), sort_keys=True)
+            for region in (None, row[1]):
+                output = outputs.get(region)
+                if output is None:
+                    path = rendered_usage_path(name, region)
+                    output = outputs[region] = (path, open(path + tmp, 'w'), gzip.open(path + ".gz" + tmp, 'wt', compresslevel=6))
+                    separator = '{"readings": ['
+                else:
+                    separator = ', '
+                output[1].write(separator + reading)
+                output[2].write(separator + reading)
+
+        for path, plain, compressed in outputs.values():
+            plain.write(']}')
+            compressed.write(']}')
+            plain.close()
+            compressed.close()
+            os.replace(path + tmp, path)
+            os.replace(path + ".gz" + tmp, path + ".gz")
+    finally:
+        # Only left over if rendering failed part-way
+        for path, plain, compressed in outputs.values():
+            plain.close()
+            compressed.close()
+            for tmp_file in (path + tmp, path + ".gz" + tmp):
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+    logger.info("Rendered %s usage for %d region(s).", name, len(outputs) - 1)
+
+
+def load_usage_files():
+    """Read each usage file once into everything served from it.
+
+    Returns (daily UsageFileIndex, monthly UsageFileIndex, latest daily row per meter, latest
+    monthly row per meter, (meter_id, month) rollup, UsageRollupCube). A row that supersedes
+    an earlier one takes its place in the cube and the rollup.
+    """
+    global monthly_superseded_rows
+
+    latest_daily_usage, latest_monthly_usage = {}, {}
+    monthly_usage = {}
+    monthly_rows = 0
+    # (period, region, area, dwelling_type) -> [total, count] per granularity, rolled up into the cube once read
+    cells = {"day": defaultdict(lambda: [0.0, 0]), "month": defaultdict(lambda: [0.0, 0])}
+
+    def visitor(granularity, latest_usage):
+        granularity_cells = cells[granularity]
+
+        def visit(row, superseded):
+            # The latest period wins; a later row for the same period supersedes the earlier one
+            latest = latest_usage.get(row[0])
+            if latest is None or usage_period_key(row[4]) >= usage_period_key(latest[4]):
+                latest_usage[row[0]] = row
+            usage = float(row[5])
+            cell = granularity_cells[(row[4], row[1], row[2], row[3])]
+            cell[0] += usage
+            cell[1] += 1
+            if superseded is not None:
+                cell = granularity_cells[(superseded[4], superseded[1], superseded[2], superseded[3])]
+                cell[0] -= float(superseded[5])
+                cell[1] -= 1
+
+            if granularity == "month":
+                nonlocal monthly_rows
+                monthly_usage[(row[0], row[4])] = [row[0], row[1], row[2], row[3], row[4], usage]
+                monthly_rows += 1
+        return visit
+
+    daily_usage_index = UsageFileIndex(daily_file, visitor("day", latest_daily_usage))
+    monthly_usage_index = UsageFileIndex(monthly_file, visitor("month", latest_monthly_usage))
+    monthly_superseded_rows = monthly_rows - len(monthly_usage)
+
+    usage_cube = UsageRollupCube()
+    for granularity, granularity_cells in cells.items():
+        for (period, region, area, dwelling_type), (total, count) in granularity_cells.items():
+            if count:
+                usage_cube.add(granularity, period, region, area, dwelling_type, total, count)
+    return daily_usage_index, monthly_usage_index, latest_daily_usage, latest_monthly_usage, monthly_usage, usage_cube
+
+
+# Load the month-to-date rollup from the monthly usage CSV
+def load_monthly_usage_rollup():
+    """Load a (meter_id, month) -> monthly usage row rollup from file; later rows supersede earlier ones"""
+    global monthly_superseded_rows
+
+    monthly_usage = {}
+    monthly_superseded_rows = 0
+    if not os.path.exists(monthly_file):
+        return monthly_usage
+
+    rows = 0
+    with open(monthly_file, 'r', newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None)  # skip header
+        for row in reader:
+            if row:
+                monthly_usage[(row[0], row[4])] = [row[0], row[1], row[2], row[3], row[4], float(row[5])]
+                rows += 1
+    monthly_superseded_rows = rows - len(monthly_usage)
+    return monthly_usage
+
+
+def calculate_monthly_usage(daily_usage_data, monthly_usage, latest_monthly_usage=None, usage_cube=None):
+    """Fold the day's daily usage rows into the monthly rollup and append the meter-months touched to the CSV."""
+    global monthly_superseded_rows
+
+    if not daily_usage_data:
+        logger.info("No daily usage to roll up.")
         return
 
-    df['Date'] = pd.to_datetime(df['Date']).dt.strftime("%Y-%b")
+    months = {}  # date -> month, the day's rows usually share one date
+    touched = {} # (meter_id, month) -> already in the file
+    for meter_id, region, area, dwelling_type, date, daily_usage in daily_usage_data:
+        month = months.get(date)
+        if month is None:
+            month = months[date] = datetime.strptime(date, '%Y-%m-%d').strftime("%Y-%b")
+
+        key = (meter_id, month)
+        if key in monthly_usage:
+            monthly_usage[key][5] += daily_usage
+            logger.debug("Updated usage for Meter ID %s.", meter_id)
+            new_meter_month = 0
+        else:
+            monthly_usage[key] = [meter_id, region, area, dwelling_type, month, daily_usage]
+            logger.debug("Added new record for Meter ID %s.", meter_id)
+            new_meter_month = 1
+        touched.setdefault(key, not new_meter_month)
 
-    current_month = datetime.now(pytz.timezone("Asia/Singapore")).strftime("%Y-%b")
-    # I think we should give users the last month, not the current month 
-    if os.path.exists(monthly_file):
-        monthly_df = pd.read_csv(monthly_file)
-    else:
-        monthly_df = pd.DataFrame(columns=["Meter_id", "Region", "Area", "Dwelling_type", "Month", "Monthly_Usage (kWh)"])
+        # Monthly means are per meter, so a meter only counts once per month
+        if usage_cube is not None:
+            usage_cube.add("month", month, region, area, dwelling_type, daily_usage, count=new_meter_month)
 
-    df_month = df[df["Date"] == current_month]
+    append_monthly_usage([monthly_usage[key] for key in touched])
+    monthly_superseded_rows += sum(touched.values())
 
-    if df_month.empty:
-        print(f"No data found for {current_month}.")
-        return
+    if latest_monthly_usage is not None:
+        for key in touched:
+            latest = latest_monthly_usage.get(key[0])
+            if latest is None or usage_period_key(key[1]) >= usage_period_key(latest[4]):
+                latest_monthly_usage[key[0]] = [str(value) for value in monthly_usage[key]]
 
-    for meter_id in df_month["Meter_id"].unique():
-        df_month_id = df_month[df_month["Meter_id"] == meter_id]
-        monthly_usage = df_month_id["Daily_Usage (kWh)"].sum()
-        
-        # Check if this meter_id already has an entry for the current month
-        existing_idx = monthly_df[(monthly_df["Meter_id"] == meter_id) & (monthly_df["Month"] == current_month)].index
 
-        if not existing_idx.empty:
-            monthly_df.loc[existing_idx, "Monthly_Usage (kWh)"] = monthly_usage
-            print(f"Updated usage for Meter ID {meter_id}.")
-        else:
-            new_record = {
-                "Meter_id": meter_id,
-                "Region": df_month_id.iloc[0]["Region"],
-                "Area": df_month_id.iloc[0]["Area"],
-                "Dwelling_type": df_month_id.iloc[0]["Dwelling_type"],
-                "Month": current_month,
-                "Monthly_Usage (kWh)": monthly_usage
-            }
-            monthly_df = pd.concat([monthly_df, pd.DataFrame([new_record])], ignore_index=True)
-            print(f"Added new record for Meter ID {meter_id}.")
-
-    # Save updated monthly usage data
-    monthly_df.to_csv(monthly_file, index=False)
-    print(f"Monthly usage data saved successfully to {monthly_file}.")
\ No newline at end of file
+def append_monthly_usage(rows):
+    """Append monthly usage rows to the CSV; each supersedes any earlier row for its meter and month"""
+    monthly_exists = os.path.exists(monthly_file)
+    try:
+        with open(monthly_file, 'a', newline='') as file:
+            writer = csv.writer(file)
+            if not monthly_exists:
+                writer.writerow(["Meter_id", "Region", "Area", "Dwelling_type", "Month", "Monthly_Usage (kWh)"])
+            writer.writerows(rows)
+    except IOError as e:
+        logger.error("Error writing to file: %s", e)
+        raise
+    logger.info("Appended %d monthly usage row(s) to %s.", len(rows), monthly_file)
+
+
+def compact_monthly_usage_if_due(monthly_usage, workers=None):
+    """Compact the monthly usage CSV once it holds as many superseded rows as live ones; True if it did"""
+    if not monthly_superseded_rows or monthly_superseded_rows < len(monthly_usage):
+        return False
+    compact_monthly_usage(monthly_usage, workers)
+    return True
+
+
+def compact_monthly_usage(monthly_usage, workers=None):
+    """Rewrite the monthly usage CSV from the rollup, one row per meter and month, with an atomic rename.
+
+    The whole rollup is rewritten, so workers format contiguous chunks of it and the chunks are written in order.
+    """
+    global monthly_superseded_rows
+
+    rows = list(monthly_usage.values())
+    workers = min(workers or batch_workers, len(rows) // batch_min_rows_per_worker) or 1
+    chunk_size = max(-(-len(rows) // workers), 1)
+    chunks = [rows[start:start + chunk_size] for start in range(0, len(rows), chunk_size)]
+
+    tmp_file = monthly_file + ".tmp"
+    try:
+        with open(tmp_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["Meter_id", "Region", "Area", "Dwelling_type", "Month", "Monthly_Usage (kWh)"])
+            for text in run_in_process_pool(usage_csv_text, chunks):
+                file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_file, monthly_file)
+    except IOError as e:
+        logger.error("Error writing to file: %s", e)
+        raise
+    monthly_superseded_rows = 0
+    logger.info("Compacted %d monthly usage row(s) into %s.", len(rows), monthly_file)
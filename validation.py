@@ -0,0 +1,145 @@
+import re
+import math
+from array import array
+from calendar import timegm, monthrange
+
+from lazy_import import lazy_import
+
+# Only batches need numpy, so it loads on the first one
+np = lazy_import('numpy')
+
+# Compiled once. Date and time accept what datetime.strptime('%Y-%m-%d') / ('%H:%M') did, unpadded fields included
+meter_id_pattern = re.compile(r"[0-9]{3}-[0-9]{3}-[0-9]{3}")
+date_pattern = re.compile(r"([0-9]{4})-(1[0-2]|0[1-9]|[1-9])-(3[01]|[12][0-9]|0[1-9]|[1-9])")
+time_pattern = re.compile(r"(2[0-3]|[01][0-9]|[0-9]):([0-5][0-9]|[0-9])")
+meter_id_digits = [0, 1, 2, 4, 5, 6, 8, 9, 10] # positions of the digits in a meter Id, the others are dashes
+
+# Error code -> message, as returned by MeterReading.validate_and_create
+error_messages = {
+    "missing_field": "All fields are required",
+    "invalid_meter_id": "Invalid meter Id format. Use XXX-XXX-XXX (digits only)",
+    "invalid_date": "Invalid date format. Use YYYY-MM-DD",
+    "invalid_time": "Invalid time format. Use HH:MM",
+    "invalid_reading": "Electricity reading must be a number",
+    "negative_reading": "Electricity reading must be positive",
+}
+# validate_readings' error numbers, in the order validate_reading checks them
+error_codes = (None, "missing_field", "invalid_meter_id", "invalid_date", "invalid_time", "invalid_reading", "negative_reading")
+
+# Parsed dates and times -> epoch seconds; readings arrive for a handful of distinct dates and at most 1440 times
+_date_seconds = {}
+_time_seconds = {}
+_date_cache_size = 4096
+
+
+def is_valid_meter_id(meter_id):
+    return isinstance(meter_id, str) and meter_id_pattern.fullmatch(meter_id) is not None
+
+
+def date_seconds(date):
+    """Epoch seconds of a YYYY-MM-DD date at 00:00 UTC, or None if it isn't a valid date"""
+    if not isinstance(date, str):
+        return None
+    seconds = _date_seconds.get(date)
+    if seconds is None:
+        match = date_pattern.fullmatch(date)
+        if match is None:
+            return None
+        year, month, day = int(match[1]), int(match[2]), int(match[3])
+        if day > 28 and day > monthrange(year, month)[1]:
+            return None
+        if len(_date_seconds) >= _date_cache_size:
+            _date_seconds.clear()
+        seconds = _date_seconds[date] = timegm((year, month, day, 0, 0, 0))
+    return seconds
+
+
+def time_seconds(time):
+    """Seconds since midnight of an HH:MM time, or None if it isn't a valid time"""
+    if not isinstance(time, str):
+        return None
+    seconds = _time_seconds.get(time)
+    if seconds is None:
+        match = time_pattern.fullmatch(time)
+        if match is None:
+            return None
+        seconds = _time_seconds[time] = int(match[1]) * 3600 + int(match[2]) * 60
+    return seconds
+
+
+def validate_reading(meter_id, date, time, electricity_reading):
+    """Check one reading; returns (error code or None, epoch-second timestamp, reading as a float)"""
+    if not meter_id or not date or not time or electricity_reading is None or electricity_reading == "":
+        return "missing_field", None, None
+    if not is_valid_meter_id(meter_id):
+        return "invalid_meter_id", None, None
+
+    day = date_seconds(date)
+    if day is None:
+        return "invalid_date", None, None
+    minute = time_seconds(time)
+    if minute is None:
+        return "invalid_time", None, None
+
+    try:
+        value = float(electricity_reading)
+    except (TypeError, ValueError):
+        return "invalid_reading", None, None
+    if not math.isfinite(value):
+        return "invalid_reading", None, None
+    if value < 0:
+        return "negative_reading", None, None
+    return None, day + minute, value
+
+
+def validate_readings(meter_ids, dates, times, electricity_readings):
+    """Check a batch of readings given as columns, a column at a time, with the codes validate_reading gives.
+
+    Meter Ids are checked as one byte matrix, each distinct date and time is parsed once, and
+    readings are converted to floats by numpy in one call. Returns (errors, timestamps,
+    readings): an error code or None per row, and typed arrays of the epoch-second timestamps
+    and float readings, 0 for rejected rows.
+    """
+    count = len(meter_ids)
+    if not count:
+        return [], array('q'), array('d')
+
+    missing = np.fromiter((not meter_id or not date or not time or reading is None or reading == ""
+                           for meter_id, date, time, reading in zip(meter_ids, dates, times, electricity_readings)), dtype=bool, count=count)
+
+    # A meter Id is 11 ASCII characters, so the column is checked as one (rows, 11) byte matrix
+    fixed = "".join(meter_id if isinstance(meter_id, str) and len(meter_id) == 11 else "-" * 11 for meter_id in meter_ids)
+    chars = np.frombuffer(fixed.encode("ascii", "replace"), dtype=np.uint8).reshape(count, 11)
+    digits = chars[:, meter_id_digits]
+    valid_meter_id = ((digits >= ord("0")) & (digits <= ord("9"))).all(axis=1) & (chars[:, [3, 7]] == ord("-")).all(axis=1)
+
+    days, valid_date = _parse_column(dates, date_seconds)
+    minutes, valid_time = _parse_column(times, time_seconds)
+
+    try:
+        values = np.array(electricity_readings, dtype=np.float64)
+        if values.shape != (count,):
+            raise ValueError("nested readings")
+    except (TypeError, ValueError):
+        values = np.fromiter((_to_float(reading) for reading in electricity_readings), dtype=np.float64, count=count)
+
+    codes = np.select([missing, ~valid_meter_id, ~valid_date, ~valid_time, ~np.isfinite(values), values < 0], range(1, 7), 0)
+    accepted = codes == 0
+    timestamps = array('q', np.where(accepted, days + minutes, 0).astype(np.int64).tobytes())
+    readings = array('d', np.where(accepted, values, 0.0).tobytes())
+    return [error_codes[code] for code in codes.tolist()], timestamps, readings
+
+
+def _parse_column(values, parse):
+    """Parse each distinct string of a column once; returns (parsed values, 0 where invalid, and a validity mask)"""
+    parsed = {value: parse(value) for value in {value for value in values if isinstance(value, str)}}
+    results = [parsed.get(value) if isinstance(value, str) else None for value in values]
+    valid = np.fromiter((result is not None for result in results), dtype=bool, count=len(results))
+    return np.fromiter((result or 0 for result in results), dtype=np.int64, count=len(results)), valid
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan